@@ -1,12 +1,38 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Request, render_template, request, send_file, jsonify, url_for
 import os
+import sys
 import tempfile
 from werkzeug.utils import secure_filename
 import pandas as pd
 import numpy as np
-from openpyxl.styles import PatternFill, Alignment, Font
-from openpyxl.utils import get_column_letter
+import json
+import codecs
+import hashlib
+import threading
+import shutil
+import time
+import uuid
+import re
+import io
+import warnings
+import base64
+import gc
+import zipfile
+from contextlib import contextmanager, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict
 import logging
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where the app runs as a single process
+    fcntl = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,184 +40,888 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+def env_setting(name, default, parse=str):
+    """
+    Read a setting from the environment variable ADOBE_<name>.
+    
+    Parameters:
+      name (str): Setting name, e.g. 'UPLOAD_FOLDER'
+      default: Value used when the variable is unset or empty
+      parse (callable): Converts the variable's text, e.g. int
+    """
+    value = os.environ.get(f'ADOBE_{name}', '').strip()
+    if not value:
+        return default
+    try:
+        return parse(value)
+    except ValueError:
+        raise ValueError(f"Invalid value for ADOBE_{name}: {value}")
+
 # Configure upload folder and output file
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+UPLOAD_FOLDER = env_setting('UPLOAD_FOLDER', 'uploads')
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)  # server processes may start at the same time
     
 OUTPUT_FILE = os.path.join(UPLOAD_FOLDER, 'combined_output.csv')
-COLLEGE_STATS_FOLDER = os.path.join(UPLOAD_FOLDER, 'adobe_college_stats')
-if not os.path.exists(COLLEGE_STATS_FOLDER):
-    os.makedirs(COLLEGE_STATS_FOLDER)
     
 ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
 
+# Results of each analysis run, in a folder named by the run id (see RunStore)
+RUNS_FOLDER = os.path.join(UPLOAD_FOLDER, 'runs')
+os.makedirs(RUNS_FOLDER, exist_ok=True)
+RUN_STORE_MAX_BYTES = env_setting('RUN_STORE_MAX_MB', 2048, int) * 1024 ** 2  # stored runs are evicted, oldest first, beyond this size
+RUN_STORE_MAX_AGE = 7 * 24 * 3600  # seconds since a run was last used before it is evicted
+
+# Zip of a run's reports for download_all
+REPORTS_ARCHIVE_NAME = 'adobe_college_stats.zip'
+
+# Combined log of every labelled row in a run, kept for re-analysis
+COMBINED_LOG_NAME = 'combined_adobe_logs.parquet'
+COMBINED_CSV_NAME = 'combined_adobe_logs.csv'
+EXPORT_COMBINED_CSV = False  # also write the combined log as CSV
+
+# Streaming ingestion settings
+INGEST_COLUMNS = ['User Email', 'Item Path', 'Timestamp']
+REQUIRED_COLUMNS = ['User Email', 'Item Path']
+CSV_ENCODING = 'utf-8'
+CSV_FALLBACK_ENCODING = 'latin1'  # decodes any byte, so files that are not UTF-8 never fail to read
+CSV_CHUNK_SIZE = 200000  # rows per chunk
+EXTRA_FIELD_COLUMN = '__extra_field__'  # catches lines with more fields than the header
+# pandas < 2 guesses the format of each timestamp separately unless asked to infer it once
+TIMESTAMP_PARSE_OPTIONS = {'infer_datetime_format': True} if int(pd.__version__.split('.')[0]) < 2 else {}
+ENCODING_BLOCK_SIZE = 1024 * 1024  # bytes decoded at a time to detect the encoding
+PROCESS_WORKERS = env_setting('PROCESS_WORKERS', os.cpu_count() or 1, int)  # worker processes for multi-file uploads
+
+# Duplicate row counting: 'exact' keeps a 64-bit hash per distinct
+# (User Email, Item Path) pair, 'approximate' a HyperLogLog sketch
+DUPLICATE_COUNT_MODE = 'exact'
+DUPLICATE_HLL_PRECISION = 14  # 2**14 registers, about 0.8% standard error
+
+# Background analysis jobs
+JOB_WORKERS = env_setting('JOB_WORKERS', 2, int)  # analyses that can run at the same time (per server process)
+JOB_HISTORY = 50  # finished jobs kept for polling
+JOB_FILE_MAX_AGE = 24 * 3600  # seconds since a job status file last changed before it is removed
+JOBS_FOLDER = os.path.join(UPLOAD_FOLDER, 'jobs')  # job status files, so any server process can answer a poll
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+JOB_STAGES = ['ingest', 'classify', 'aggregate', 'write reports']
+
+# JSON API over stored runs
+API_PAGE_SIZE = 100  # users per page by default
+API_MAX_PAGE_SIZE = 1000
+API_CACHED_RUNS = 4  # runs whose per-user tables are kept in memory
+API_USER_SORTS = ['email', 'college']
+
+# Usage trends (see UsageRollup)
+TREND_PERIODS = ['day', 'week', 'month']  # weeks start on Monday
+TREND_PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 31}  # days from a period's start that always reach the next one
+TREND_GROUPS = ['app', 'college', 'college_app']
+
+# Report files
+REPORT_WRITER = 'auto'  # 'auto', or a key of REPORT_WRITERS
+REPORT_STREAMING_ROWS = 20000  # 'auto' streams sheets with at least this many rows
+REPORT_WORKERS = env_setting('REPORT_WORKERS', 4, int)  # report files written at the same time
+
+# Stage timing buckets for the /metrics histograms, in seconds
+STAGE_SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+# Persistent path -> app cache shared across uploads
+APP_CACHE_FILE = os.path.join(UPLOAD_FOLDER, 'app_detection_cache.json')
+APP_CACHE_MAX_ENTRIES = 500000
+
+# App detection rules, reloaded when the file changes (see get_adobe_app_rules)
+RULES_FILE = env_setting('RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'adobe_app_rules.json'))
+RULE_FALLTHROUGH_SAMPLES = 50  # latest paths no rule matched, kept for /api/rules
+
 # Configure a larger upload size limit
-app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024  # 1GB max upload size
+app.config['MAX_CONTENT_LENGTH'] = env_setting('MAX_UPLOAD_MB', 1000, int) * 1024 * 1024  # 1GB max upload size by default
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Pipeline instrumentation
+def current_rss():
+    """
+    Resident memory of this process in bytes, or None if it cannot be read.
+    
+    Uses /proc where available; elsewhere falls back to the peak RSS, which
+    still shows growth but never a drop.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+    return None
+
+class StageTimer:
+    """
+    Wall time, rows and memory change of each stage of one analysis run.
+    
+    Measuring a stage again (once per chunk, say) adds to its totals. Timers
+    are picklable, so worker processes time their own stages and send the
+    timer back to be merged. Merged worker stages overlap in time, so their
+    seconds can add up to more than the wall time of the run.
+    """
+    
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        return {'stages': self.stages}
+    
+    def __setstate__(self, state):
+        self.stages = state['stages']
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Time the body of a with block as stage `name`.
+        
+        Yields a dict whose 'rows' can be set inside the block when the row
+        count is only known at the end.
+        """
+        measured = {'rows': rows}
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield measured
+        finally:
+            rss_after = current_rss()
+            memory = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            self.add(name, time.perf_counter() - start, measured['rows'], memory)
+    
+    def add(self, name, seconds, rows=None, memory=None, calls=1):
+        """Add one measurement of stage `name`."""
+        with self._lock:
+            entry = self.stages.setdefault(name, {'seconds': 0.0, 'rows': None, 'memory': None, 'calls': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += calls
+            if rows is not None:
+                entry['rows'] = (entry['rows'] or 0) + rows
+            if memory is not None:
+                entry['memory'] = (entry['memory'] or 0) + memory
+    
+    def merge(self, other):
+        """Add the stages of another timer, e.g. one from a worker process."""
+        for name, entry in other.stages.items():
+            self.add(name, entry['seconds'], entry['rows'], entry['memory'], entry['calls'])
+    
+    def breakdown(self):
+        """Return the stages as a list of dicts for the preview and JSON."""
+        with self._lock:
+            stages = list(self.stages.items())
+        return [{
+            'stage': name,
+            'seconds': round(entry['seconds'], 3),
+            'rows': entry['rows'],
+            'rows_per_second': int(entry['rows'] / entry['seconds']) if entry['rows'] and entry['seconds'] else None,
+            'memory_delta_mb': round(entry['memory'] / (1024 * 1024), 1) if entry['memory'] is not None else None,
+        } for name, entry in stages]
+
+class StageMetrics:
+    """
+    Stage timings of all finished runs, rendered in Prometheus text format.
+    
+    Each stage gets a duration histogram (one observation per run), a row
+    counter and the memory change of its latest run.
+    """
+    
+    def __init__(self, buckets=STAGE_SECONDS_BUCKETS):
+        self.buckets = list(buckets)
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._seconds = OrderedDict()
+        self._rows = OrderedDict()
+        self._memory = OrderedDict()
+    
+    def observe(self, timer):
+        """Record every stage of a finished run."""
+        with self._lock:
+            self._runs += 1
+            for name, entry in timer.stages.items():
+                histogram = self._seconds.setdefault(name, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+                for i, bound in enumerate(self.buckets):
+                    if entry['seconds'] <= bound:
+                        histogram['buckets'][i] += 1
+                histogram['sum'] += entry['seconds']
+                histogram['count'] += 1
+                if entry['rows'] is not None:
+                    self._rows[name] = self._rows.get(name, 0) + entry['rows']
+                if entry['memory'] is not None:
+                    self._memory[name] = entry['memory']
+    
+    def render(self):
+        """Return the metrics in Prometheus text exposition format."""
+        def label(name):
+            return name.replace('\\', '\\\\').replace('"', '\\"')
+        
+        with self._lock:
+            lines = [
+                '# HELP adobe_analysis_runs_total Analysis runs completed.',
+                '# TYPE adobe_analysis_runs_total counter',
+                f'adobe_analysis_runs_total {self._runs}',
+                '# HELP adobe_analysis_stage_seconds Wall time of each analysis stage per run.',
+                '# TYPE adobe_analysis_stage_seconds histogram',
+            ]
+            for name, histogram in self._seconds.items():
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(f'adobe_analysis_stage_seconds_bucket{{stage="{label(name)}",le="{bound}"}} {count}')
+                lines.append(f'adobe_analysis_stage_seconds_bucket{{stage="{label(name)}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'adobe_analysis_stage_seconds_sum{{stage="{label(name)}"}} {histogram["sum"]}')
+                lines.append(f'adobe_analysis_stage_seconds_count{{stage="{label(name)}"}} {histogram["count"]}')
+            lines += [
+                '# HELP adobe_analysis_stage_rows_total Rows processed by each analysis stage.',
+                '# TYPE adobe_analysis_stage_rows_total counter',
+            ]
+            lines += [f'adobe_analysis_stage_rows_total{{stage="{label(name)}"}} {rows}' for name, rows in self._rows.items()]
+            lines += [
+                '# HELP adobe_analysis_stage_memory_delta_bytes Resident memory change of each stage in the latest run.',
+                '# TYPE adobe_analysis_stage_memory_delta_bytes gauge',
+            ]
+            lines += [f'adobe_analysis_stage_memory_delta_bytes{{stage="{label(name)}"}} {memory}' for name, memory in self._memory.items()]
+        return '\n'.join(lines) + '\n'
+
+stage_metrics = StageMetrics()
+
 # Adobe Analysis Functions
+class AdobeAppRules:
+    """
+    Adobe app detection rules, compiled from a rules file (see RULES_FILE).
+    
+    The file holds the app catalogue and an ordered list of rules. The
+    first rule matching a lowercased Item Path labels it; paths no rule
+    matches get `default_app`, and missing paths `missing_app`. A rule has
+    an "app" and one or both of:
+      - "contains": a substring of the path. With "word": true it must not
+        touch a word character (letter, digit or underscore) on either
+        side, so "xd" matches "/designs/xd/" but not "/xdata/", "/0xd3f/"
+        or "/file_xd_v2".
+      - "extension": the os.path.splitext extension, e.g. ".psd".
+    
+    Rules are identified by their position: match() and match_one() return
+    rule ids, with missing_id and default_id after the last rule, and
+    `labels` maps an id to its app name.
+    
+    The "contains"-only rules are compiled into one Aho-Corasick automaton
+    that match() runs over every path of a column at once; extensions are a
+    dict lookup. match_one() is the per-path reference implementation and
+    the two always agree.
+    
+    Parameters:
+    spec (dict): The parsed rules file
+    """
+    # Automaton symbols other than the characters used by the patterns
+    OTHER = 0  # any other non-word character
+    WORD = 1  # any other word character
+    EDGE = 2  # start or end of a path
+    
+    def __init__(self, spec):
+        # Check the rules file
+        if not isinstance(spec, dict):
+            raise ValueError("Invalid rules file: expected a JSON object")
+        apps = spec.get('apps')
+        if not isinstance(apps, list) or not apps or not all(isinstance(app_name, str) for app_name in apps):
+            raise ValueError("Invalid rules file: 'apps' must be a list of app names")
+        if spec.get('default_app') not in apps:
+            raise ValueError("Invalid rules file: 'default_app' must be one of 'apps'")
+        if not isinstance(spec.get('missing_app'), str):
+            raise ValueError("Invalid rules file: 'missing_app' must be an app name")
+        if not isinstance(spec.get('rules'), list):
+            raise ValueError("Invalid rules file: 'rules' must be a list")
+        
+        self.rules = []
+        for number, rule in enumerate(spec['rules'], start=1):
+            if not isinstance(rule, dict) or set(rule) - {'app', 'contains', 'word', 'extension'}:
+                raise ValueError(f"Invalid rule {number}: expected app, contains, word and/or extension")
+            if rule.get('app') not in apps:
+                raise ValueError(f"Invalid rule {number}: app {rule.get('app')!r} is not in 'apps'")
+            if 'contains' not in rule and 'extension' not in rule:
+                raise ValueError(f"Invalid rule {number}: needs 'contains' or 'extension'")
+            if 'contains' in rule and not (isinstance(rule['contains'], str) and rule['contains']):
+                raise ValueError(f"Invalid rule {number}: 'contains' must be a non-empty string")
+            if 'extension' in rule and not (isinstance(rule['extension'], str) and rule['extension'].startswith('.')):
+                raise ValueError(f"Invalid rule {number}: 'extension' must start with a dot")
+            if 'word' in rule and (not isinstance(rule['word'], bool) or 'contains' not in rule):
+                raise ValueError(f"Invalid rule {number}: 'word' must be true or false, next to 'contains'")
+            
+            compiled = {'app': rule['app']}
+            if 'contains' in rule:
+                compiled['contains'] = rule['contains'].lower()
+                compiled['word'] = rule.get('word', False)
+            if 'extension' in rule:
+                compiled['extension'] = rule['extension'].lower()
+            self.rules.append(compiled)
+        
+        self.apps = list(apps)
+        self.default_app = spec['default_app']
+        self.missing_app = spec['missing_app']
+        self.revision = spec.get('version')
+        self.missing_id = len(self.rules)
+        self.default_id = len(self.rules) + 1
+        self.labels = np.array([rule['app'] for rule in self.rules] + [self.missing_app, self.default_app],
+                               dtype=object)
+        
+        # Labels as a small categorical: `app_codes` maps a rule id to its code
+        # in the sorted `app_categories`
+        app_codes, app_categories = pd.factorize(self.labels, sort=True)
+        self.app_codes = app_codes.astype(np.int16)
+        self.app_categories = pd.Index(app_categories, dtype=object)
+        
+        # The version covers everything that affects labels, so caches and
+        # stored runs notice any edit, whether or not "version" was bumped
+        fingerprint = json.dumps([self.apps, self.default_app, self.missing_app, self.rules], sort_keys=True)
+        self.version = f"{self.revision}-{hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:12]}"
+        
+        # Extension rules: the first rule of an extension wins outright unless
+        # it also needs a substring, in which case its rules are tried in order
+        self._extension_rules = {rule['extension'] for rule in self.rules if 'extension' in rule}
+        self._extension_ids = {}
+        self._conditional_extensions = {}
+        for rule_id, rule in enumerate(self.rules):
+            extension = rule.get('extension')
+            if extension is None or extension in self._extension_ids:
+                continue
+            candidates = self._conditional_extensions.setdefault(extension, [])
+            candidates.append(rule_id)
+            if 'contains' not in rule and len(candidates) == 1:
+                self._extension_ids[extension] = rule_id
+                del self._conditional_extensions[extension]
+        
+        self._compile_automaton()
+    
+    def _compile_automaton(self):
+        """Build the Aho-Corasick transition table of the "contains"-only rules."""
+        substring_rules = [(rule_id, rule) for rule_id, rule in enumerate(self.rules) if 'extension' not in rule]
+        
+        # One symbol per pattern character, plus OTHER, WORD and EDGE
+        self._symbols = {}
+        for _, rule in substring_rules:
+            for char in rule['contains']:
+                self._symbols.setdefault(char, len(self._symbols) + 3)
+        symbol_count = len(self._symbols) + 3
+        self._ascii_symbols = np.array([self._symbol_of(chr(code)) for code in range(256)], dtype=np.int32)
+        self._ascii_symbols[ord(_ROW_SEPARATOR)] = self.EDGE
+        
+        # A word pattern is spelled out once per pair of non-word neighbours
+        boundaries = [self.OTHER, self.EDGE] + [symbol for char, symbol in self._symbols.items()
+                                                if not self._is_word_char(char)]
+        trie = [{}]
+        best = [self.default_id]
+        for rule_id, rule in substring_rules:
+            word = [self._symbols[char] for char in rule['contains']]
+            if rule['word']:
+                sequences = [[before] + word + [after] for before in boundaries for after in boundaries]
+            else:
+                sequences = [word]
+            for sequence in sequences:
+                state = 0
+                for symbol in sequence:
+                    if symbol not in trie[state]:
+                        trie.append({})
+                        best.append(self.default_id)
+                        trie[state][symbol] = len(trie) - 1
+                    state = trie[state][symbol]
+                best[state] = min(best[state], rule_id)
+        
+        # Breadth-first: follow failure links to fill in every transition, and
+        # give each state the first rule of any pattern ending there
+        goto = np.zeros((len(trie), symbol_count), dtype=np.int32)
+        fail = [0] * len(trie)
+        queue = list(trie[0].values())
+        for symbol, state in trie[0].items():
+            goto[0, symbol] = state
+        for state in queue:
+            best[state] = min(best[state], best[fail[state]])
+            for symbol in range(symbol_count):
+                child = trie[state].get(symbol)
+                if child is None:
+                    goto[state, symbol] = goto[fail[state], symbol]
+                else:
+                    fail[child] = goto[fail[state], symbol]
+                    goto[state, symbol] = child
+                    queue.append(child)
+        self._goto = goto
+        self._best = np.array(best, dtype=np.int32)
+    
+    def _symbol_of(self, char):
+        symbol = self._symbols.get(char)
+        if symbol is not None:
+            return symbol
+        return self.WORD if self._is_word_char(char) else self.OTHER
+    
+    @staticmethod
+    def _is_word_char(char):
+        """Letters, digits and underscores; a word pattern must not touch one."""
+        return char.isalnum() or char == '_'
+    
+    @classmethod
+    def _contains(cls, path, pattern, word):
+        """Check for pattern in path, away from word characters if word is set."""
+        start = path.find(pattern)
+        while start >= 0:
+            end = start + len(pattern)
+            if not word or ((start == 0 or not cls._is_word_char(path[start - 1])) and
+                            (end == len(path) or not cls._is_word_char(path[end]))):
+                return True
+            start = path.find(pattern, start + 1)
+        return False
+    
+    def _rule_matches(self, rule_id, path):
+        rule = self.rules[rule_id]
+        return 'contains' not in rule or self._contains(path, rule['contains'], rule['word'])
+    
+    def match_one(self, item_path):
+        """Return the rule id of one Item Path (reference implementation)."""
+        if pd.isna(item_path):
+            return self.missing_id
+        path = str(item_path).lower()
+        extension = os.path.splitext(path)[1]
+        for rule_id, rule in enumerate(self.rules):
+            if rule.get('extension', extension) == extension and self._rule_matches(rule_id, path):
+                return rule_id
+        return self.default_id
+    
+    def match(self, item_paths):
+        """
+        Return the rule id of every Item Path of a column, as match_one would.
+        
+        Parameters:
+          item_paths (pd.Series): Item Path values.
+        
+        Returns an int64 array aligned with item_paths.
+        """
+        item_paths = pd.Series(item_paths)
+        missing = item_paths.isna().to_numpy()
+        rule_ids = np.full(len(item_paths), self.missing_id, dtype=np.int64)
+        paths = [str(path) for path in item_paths.to_numpy()[~missing]]
+        
+        # Lowercasing the joined text matches per-path lowercasing; fall back to
+        # lowering path by path if some path contains the separator itself
+        text = _ROW_SEPARATOR.join(paths).lower()
+        lowered = text.split(_ROW_SEPARATOR)
+        if len(lowered) != len(paths):
+            lowered = [path.lower() for path in paths]
+            text = _ROW_SEPARATOR.join(lowered)
+        
+        rule_ids[~missing] = np.minimum(self._match_substrings(text, lowered), self._match_extensions(lowered))
+        return rule_ids
+    
+    def _match_substrings(self, text, lowered):
+        """First "contains"-only rule of each lowercased path, or default_id."""
+        lengths = np.fromiter(map(len, lowered), dtype=np.int64, count=len(lowered))
+        codes = _encode_column(_ROW_SEPARATOR + text + _ROW_SEPARATOR)
+        if codes.dtype == np.uint8:
+            symbols = self._ascii_symbols[codes]
+        else:
+            symbols = np.empty(len(codes), dtype=np.int32)
+            small = codes < 256
+            symbols[small] = self._ascii_symbols[codes[small]]
+            wide, inverse = np.unique(codes[~small], return_inverse=True)
+            symbols[~small] = np.array([self._symbol_of(chr(code)) for code in wide], dtype=np.int32)[inverse]
+        
+        # Each path is scanned from the separator before it to the one after
+        # it, so the edges are symbols too. All paths advance together one
+        # character at a time, longest first, so the active paths are always
+        # a prefix of the arrays.
+        starts = np.zeros(len(lowered), dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+        order = np.argsort(-lengths, kind='stable')
+        steps = lengths[order] + 2
+        positions = starts[order]
+        states = np.zeros(len(lowered), dtype=np.int32)
+        found = np.full(len(lowered), self.default_id, dtype=np.int32)
+        for step in range(int(steps[0]) if len(steps) else 0):
+            active = int(np.searchsorted(-steps, -step, side='left'))
+            active_states = self._goto[states[:active], symbols[positions[:active] + step]]
+            states[:active] = active_states
+            np.minimum(found[:active], self._best[active_states], out=found[:active])
+        
+        rule_ids = np.empty(len(lowered), dtype=np.int64)
+        rule_ids[order] = found
+        return rule_ids
+    
+    def _match_extensions(self, lowered):
+        """First extension rule of each lowercased path, or default_id."""
+        rule_ids = np.full(len(lowered), self.default_id, dtype=np.int64)
+        
+        # A splitext extension starts at the last dot, so only paths ending
+        # in a rule's extension need the full check
+        for row in [row for row, path in enumerate(lowered) if path[path.rfind('.'):] in self._extension_rules]:
+            path = lowered[row]
+            extension = os.path.splitext(path)[1]
+            rule_id = self._extension_ids.get(extension)
+            if rule_id is not None:
+                rule_ids[row] = rule_id
+            elif extension in self._conditional_extensions:
+                # The first rule of this extension also needs a substring
+                rule_ids[row] = next((rule_id for rule_id in self._conditional_extensions[extension]
+                                      if self._rule_matches(rule_id, path)), self.default_id)
+        return rule_ids
+    
+    def describe(self, rule_id):
+        """Short text of a rule's conditions, e.g. 'contains "xd" (word)'."""
+        if rule_id == self.missing_id:
+            return 'missing path'
+        if rule_id == self.default_id:
+            return 'no rule matched'
+        rule = self.rules[rule_id]
+        parts = []
+        if 'extension' in rule:
+            parts.append(f'extension "{rule["extension"]}"')
+        if 'contains' in rule:
+            parts.append(f'contains "{rule["contains"]}"' + (' (word)' if rule['word'] else ''))
+        return ' and '.join(parts)
+
+def load_adobe_app_rules(path):
+    """Read and compile a rules file; ValueError if it is invalid."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return AdobeAppRules(json.load(f))
+
+adobe_app_rules = None
+adobe_app_rules_stamp = None
+adobe_app_rules_lock = threading.Lock()
+
+def get_adobe_app_rules():
+    """
+    Return the current AdobeAppRules, reloading RULES_FILE when it changes.
+    
+    The file is checked on every call (one stat), so edited rules apply to
+    the next upload without a restart. If an edited file does not load, the
+    error is logged and the previous rules stay in use.
+    """
+    global adobe_app_rules, adobe_app_rules_stamp
+    try:
+        stat = os.stat(RULES_FILE)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stamp = None
+    
+    with adobe_app_rules_lock:
+        if stamp != adobe_app_rules_stamp or adobe_app_rules is None:
+            try:
+                rules = load_adobe_app_rules(RULES_FILE)
+            except (OSError, ValueError) as e:
+                if adobe_app_rules is None:
+                    raise
+                logger.error(f"Could not reload {RULES_FILE}, keeping rules {adobe_app_rules.version}: {str(e)}")
+            else:
+                if adobe_app_rules is None or rules.version != adobe_app_rules.version:
+                    logger.info(f"Loaded Adobe app rules {rules.version} ({len(rules.rules)} rules) from {RULES_FILE}")
+                adobe_app_rules = rules
+            adobe_app_rules_stamp = stamp
+        return adobe_app_rules
+
 def get_all_adobe_apps():
     """Return a comprehensive list of all Adobe applications to ensure complete reporting."""
-    return [
-        # Core Creative Suite
-        "Adobe Photoshop",
-        "Adobe Illustrator",
-        "Adobe Premiere Pro",
-        "Adobe After Effects",
-        "Adobe InDesign",
-        "Adobe Lightroom",
-        "Adobe Acrobat",
-        
-        # Additional Design Apps
-        "Adobe XD",
-        "Adobe Dimension",
-        "Adobe Animate",
-        "Adobe Substance 3D",
-        "Adobe Fresco",
-        "Adobe Character Animator",
-        "Adobe Express",
-        
-        # Video/Audio Apps
-        "Adobe Audition",
-        "Adobe Media Encoder",
-        "Adobe SpeedGrade",
-        "Adobe Prelude",
-        
-        # Publishing/Web Apps
-        "Adobe Dreamweaver",
-        "Adobe InCopy",
-        "Adobe Bridge",
-        "Adobe RoboHelp",
-        
-        # Other Adobe Apps
-        "Adobe Scan",
-        "Adobe Cloud Storage",
-        "PDF Document",
-        "Other Adobe Files"
-    ]
+    return list(get_adobe_app_rules().apps)
 
 def extract_adobe_app(item_path, debug=False):
     """
     Extract Adobe application name from the item path.
     If no known pattern is found, returns "Other Adobe Files".
     
+    The path is matched one at a time with AdobeAppRules.match_one, the
+    reference for the column matcher AdobeAppRules.match; the two are
+    checked against each other in tests/test_app_detection.py.
+    
     Parameters:
       item_path (str): The file path to evaluate.
       debug (bool): If True, print unprocessed paths for debugging.
     """
-    if pd.isna(item_path):
-        return "Unknown"
-    
-    item_path_str = str(item_path).lower()
-    
-    # Mapping of Adobe package identifiers to app names
-    adobe_packages = {
-        "com.adobe.acrobat": "Adobe Acrobat",
-        "com.adobe.photoshop": "Adobe Photoshop",
-        "com.adobe.illustrator": "Adobe Illustrator",
-        "com.adobe.premiere": "Adobe Premiere Pro",
-        "com.adobe.aftereffects": "Adobe After Effects",
-        "com.adobe.lightroom": "Adobe Lightroom",
-        "com.adobe.xd": "Adobe XD",
-        "com.adobe.indesign": "Adobe InDesign",
-        "com.adobe.animate": "Adobe Animate",
-        "com.adobe.audition": "Adobe Audition",
-        "com.adobe.dreamweaver": "Adobe Dreamweaver",
-        "com.adobe.express": "Adobe Express"
-    }
+    rules = get_adobe_app_rules()
+    rule_id = rules.match_one(item_path)
+    
+    # Optionally, log unprocessed paths for debugging purposes
+    if debug and rule_id == rules.default_id:
+        logger.debug(f"Unprocessed item path: {str(item_path).lower()}")
+    
+    return rules.labels[rule_id]
+
+def _encode_column(text):
+    """
+    Encode joined paths as a numpy array of code points, one byte per
+    character when the text is plain ASCII.
+    """
+    if text.isascii():
+        return np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+# Paths are joined with this character for batch matching; no rule contains it
+_ROW_SEPARATOR = '\x00'
+
+def classify_adobe_apps(item_paths, rules=None):
+    """
+    Batch version of extract_adobe_app for a whole column.
+    
+    Parameters:
+      item_paths (pd.Series): Item Path values.
+      rules (AdobeAppRules): Rules to use; defaults to the current ones.
+    
+    Returns a Series of app names aligned with item_paths.
+    """
+    rules = rules or get_adobe_app_rules()
+    return pd.Series(rules.labels[rules.match(item_paths)], index=pd.Series(item_paths).index)
+
+def get_rules_version():
+    """
+    Return the version of the current detection rules.
+    
+    Cached labels are only valid for the rules that produced them, so the
+    version changes whenever the rules file changes.
+    """
+    return get_adobe_app_rules().version
+
+class RuleHitCounter:
+    """
+    Rows labelled by each detection rule, to show which rules do the work.
+    
+    Counts every row detect_adobe_apps labels, cache hits included, and
+    keeps the latest distinct paths that no rule matched. Counts are kept
+    for one rules version and start over when rows labelled by another
+    version arrive. Counters are picklable: worker processes count into
+    the FileSummary's own counter and the parent merges it here.
+    """
+    
+    def __init__(self, samples=RULE_FALLTHROUGH_SAMPLES):
+        self.samples = samples
+        self.version = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.fallthrough = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __getstate__(self):
+        return {'samples': self.samples, 'version': self.version, 'counts': self.counts,
+                'fallthrough': self.fallthrough}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    def add(self, rules, rule_ids, fallthrough=()):
+        """Count rows by rule id, and remember paths that fell through to default_app."""
+        self._add(rules.version, np.bincount(rule_ids, minlength=len(rules.labels)), fallthrough)
     
-    # Check for app identifiers in the path
-    for package, app_name in adobe_packages.items():
-        if package in item_path_str:
-            return app_name
+    def merge(self, other):
+        """Add the counts of another counter, e.g. one from a worker process."""
+        if other.version is not None:
+            self._add(other.version, other.counts, list(other.fallthrough))
+    
+    def _add(self, version, counts, fallthrough):
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self.counts = np.zeros(len(counts), dtype=np.int64)
+                self.fallthrough = OrderedDict()
+            self.counts += counts
+            for path in fallthrough:
+                self.fallthrough[path] = None
+                self.fallthrough.move_to_end(path)
+            while len(self.fallthrough) > self.samples:
+                self.fallthrough.popitem(last=False)
+    
+    def report(self, rules):
+        """
+        Return the hit count of every rule of `rules` as a list of dicts,
+        plus the default and missing entries and the fall-through samples.
+        """
+        with self._lock:
+            counts = self.counts if self.version == rules.version else np.zeros(len(rules.labels), dtype=np.int64)
+            fallthrough = list(self.fallthrough) if self.version == rules.version else []
+        return {
+            'version': rules.version,
+            'revision': rules.revision,
+            'rules': [{'id': rule_id, 'app': rules.labels[rule_id], 'match': rules.describe(rule_id),
+                       'hits': int(counts[rule_id])} for rule_id in range(len(rules.labels))],
+            'fallthrough_samples': fallthrough,
+        }
+    
+    def render(self, rules):
+        """Return the counts in Prometheus text exposition format."""
+        def label(text):
+            return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        
+        lines = [
+            '# HELP adobe_analysis_rule_hits_total Rows labelled by each app detection rule since the rules were loaded.',
+            '# TYPE adobe_analysis_rule_hits_total counter',
+        ]
+        for rule in self.report(rules)['rules']:
+            lines.append(f'adobe_analysis_rule_hits_total{{rule="{rule["id"]}",app="{label(rule["app"])}",'
+                         f'match="{label(rule["match"])}"}} {rule["hits"]}')
+        return '\n'.join(lines) + '\n'
+
+rule_hits = RuleHitCounter()
+
+class AppDetectionCache:
+    """
+    Bounded LRU cache of Item Path -> rule id, persisted to disk.
+    
+    Entries belong to one rules version (get_rules_version()); a cache file
+    written by different rules is ignored on load, and the entries start
+    over when rules of another version are used.
+    """
+    
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.version = None
+        self._entries = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._added = []
+    
+    def _use(self, version):
+        """Load the entries of `version`, dropping those of other rules."""
+        if self._entries is None or version != self.version:
+            self.version = version
+            self._added = []
+            self._dirty = False
+            self._load()
+    
+    def _load(self):
+        self._entries = OrderedDict()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('version') == self.version:
+                self._entries.update(stored.get('entries', [])[-self.max_entries:])
+            else:
+                logger.info("App detection cache was built with different rules, starting fresh")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read app detection cache {self.path}: {str(e)}")
+    
+    def preload(self, version):
+        """Load the entries of `version` now instead of on the first lookup."""
+        with self._lock:
+            self._use(version)
+    
+    def lookup(self, paths, version):
+        """Return the cached rule id for each path (None on a miss)."""
+        with self._lock:
+            self._use(version)
+            rule_ids = []
+            for path in paths:
+                rule_id = self._entries.get(path)
+                if rule_id is not None:
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                rule_ids.append(rule_id)
+            return rule_ids
+    
+    def store(self, paths, rule_ids, version, record=True):
+        """
+        Add rule ids to the cache, evicting the least recently used entries.
+        
+        Parameters:
+          record (bool): Also keep the entries for drain_added(). Entries
+            merged back from worker processes are stored with False, so
+            they are not handed out again.
+        """
+        with self._lock:
+            self._use(version)
+            for path, rule_id in zip(paths, rule_ids):
+                if self._entries.get(path) != int(rule_id):
+                    self._dirty = True
+                self._entries[path] = int(rule_id)
+                self._entries.move_to_end(path)
+                if record:
+                    self._added.append((path, int(rule_id)))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def drain_added(self):
+        """Return and forget the entries stored since the last call."""
+        with self._lock:
+            added, self._added = self._added, []
+            return added
+    
+    def save(self):
+        """
+        Write the cache to disk if entries were stored since the last save.
+        
+        The entries are copied under the lock and written outside it, so
+        lookups are not held up by the write; the file is replaced
+        atomically through a temporary file.
+        """
+        # One save at a time, so an older copy never replaces a newer one
+        with self._save_lock:
+            with self._lock:
+                if self._entries is None or not self._dirty:
+                    return
+                version, entries = self.version, list(self._entries.items())
+                self._dirty = False
             
-    # Check for app names in path
-    app_names = {
-        "photoshop": "Adobe Photoshop",
-        "illustrator": "Adobe Illustrator",
-        "premiere": "Adobe Premiere Pro",
-        "after effects": "Adobe After Effects",
-        "lightroom": "Adobe Lightroom",
-        "acrobat": "Adobe Acrobat",
-        "xd": "Adobe XD",
-        "indesign": "Adobe InDesign",
-        "animate": "Adobe Animate",
-        "express": "Adobe Express",
-    }
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': version, 'entries': entries}, f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write app detection cache {self.path}: {str(e)}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                # Try again on the next save, unless the rules changed meanwhile
+                with self._lock:
+                    if self.version == version:
+                        self._dirty = True
+
+app_detection_cache = AppDetectionCache(APP_CACHE_FILE, APP_CACHE_MAX_ENTRIES)
+
+def detect_adobe_apps(item_paths, cache=None, persist=True, rules=None, hits=None):
+    """
+    Label a whole Item Path column, classifying each distinct path only once.
     
-    for app_pattern, app_name in app_names.items():
-        if app_pattern in item_path_str:
-            return app_name
-    
-    # Check for Lightroom-specific patterns (high priority)
-    if any(pattern in item_path_str for pattern in ['/lightroom/', 'lightroom classic', '/lrcat/']):
-        return "Adobe Lightroom"
-    
-    # Check for file extensions
-    file_ext = os.path.splitext(item_path_str)[1]
-    extension_apps = {
-        # Core Creative Suite
-        ".psd": "Adobe Photoshop",
-        ".psdc": "Adobe Photoshop",
-        ".psb": "Adobe Photoshop",
-        ".aic": "Adobe Illustrator",
-        ".ai": "Adobe Illustrator",
-        ".prproj": "Adobe Premiere Pro",
-        ".aep": "Adobe After Effects",
-        ".express": "Adobe Express",
-        ".indd": "Adobe InDesign",
-        ".idrc": "Adobe InDesign",
-        ".utxt": "Adobe InDesign",
-        ".idml": "Adobe InDesign",  
-        # Adobe Acrobat & PDFs
-        ".acrobat": "Adobe Acrobat",  
-        # Lightroom
-        ".lrtemplate": "Adobe Lightroom",
-        ".lrcat": "Adobe Lightroom",
-        ".lrcat-wal": "Adobe Lightroom",
-        ".lrcat-lock": "Adobe Lightroom",
-        ".lrcat-shm": "Adobe Lightroom",
-        ".lrprev": "Adobe Lightroom",
-        # Additional Design Apps
-        ".xd": "Adobe XD",
-        ".xdc": "Adobe XD",
-        ".dn": "Adobe Dimension",
-        ".fla": "Adobe Animate",
-        ".sbsar": "Adobe Substance 3D",
-        ".fresco": "Adobe Fresco",
-        ".chproj": "Adobe Character Animator",
-        # Video/Audio Apps
-        ".sesx": "Adobe Audition",
-        ".prpreset": "Adobe Media Encoder",
-        ".ircp": "Adobe SpeedGrade",
-        ".plproj": "Adobe Prelude",
-        # Publishing/Web Apps
-        ".dw": "Adobe Dreamweaver",
-        ".icml": "Adobe InCopy",
-        ".brd": "Adobe Bridge"
-    }
+    The column is factorized, distinct paths are looked up in the persistent
+    cache, and only the misses are matched against the rules.
     
-    if file_ext in extension_apps:
-        return extension_apps[file_ext]
+    Parameters:
+      item_paths (pd.Series): Item Path values.
+      cache (AppDetectionCache): Cache to use; defaults to the shared one.
+      persist (bool): Save the cache to disk afterwards. Callers labelling
+        many chunks pass False and save once at the end.
+      rules (AdobeAppRules): Rules to use; defaults to the current ones.
+        A run passes the rules it started with to every chunk.
+      hits (RuleHitCounter): Counter for the rule hits; defaults to the
+        shared one.
+    
+    Returns a categorical Series of app names aligned with item_paths.
+    """
+    if cache is None:
+        cache = app_detection_cache
+    rules = rules or get_adobe_app_rules()
+    hits = hits if hits is not None else rule_hits
     
-    # Special handling for PDFs
-    if file_ext == '.pdf':
-        if '/cloud-content/adobe scan/' in item_path_str:
-            return 'Adobe Scan'
-        return 'PDF Document'
+    codes, uniques = pd.factorize(item_paths)
+    unique_keys = [str(path) for path in uniques]
     
-    # System paths that indicate cloud storage
-    if '/adobe-libraries/' in item_path_str or '/assets/adobe-libraries/' in item_path_str or '/cloud-content' in item_path_str:
-        return 'Adobe Cloud Storage'
+    unique_ids = np.array(cache.lookup(unique_keys, rules.version), dtype=object)
+    misses = np.flatnonzero(pd.isna(unique_ids))
+    fallthrough = []
+    if len(misses):
+        missed_ids = rules.match(pd.Series(unique_keys, dtype=object).iloc[misses])
+        unique_ids[misses] = missed_ids
+        cache.store([unique_keys[i] for i in misses], missed_ids, rules.version)
+        fallthrough = [unique_keys[i] for i in misses[missed_ids == rules.default_id]]
+        if persist:
+            cache.save()
     
-    # Optionally, log unprocessed paths for debugging purposes
-    if debug:
-        logger.debug(f"Unprocessed item path: {item_path_str}")
+    logger.debug(f"App detection: {len(item_paths)} rows, {len(uniques)} distinct paths, "
+                f"cache hits: {len(uniques) - len(misses)}, misses: {len(misses)}")
     
-    return "Other Adobe Files"
+    # factorize marks missing paths with -1
+    rule_ids = np.append(unique_ids.astype(np.int64), rules.missing_id)[codes]
+    hits.add(rules, rule_ids, fallthrough)
+    return pd.Series(pd.Categorical.from_codes(rules.app_codes[rule_ids], rules.app_categories), index=item_paths.index)
 
 def format_excel_sheet(worksheet):
     """
@@ -213,6 +943,7 @@ def format_excel_sheet(worksheet):
         worksheet.column_dimensions[column].width = adjusted_width
     
     # Format headers
+    from openpyxl.styles import PatternFill, Font
     header_fill = PatternFill(start_color="CCE5FF", end_color="CCE5FF", fill_type="solid")
     for cell in worksheet[1]:
         cell.fill = header_fill
@@ -226,6 +957,11 @@ def get_valid_colleges():
         'law', 'med', 'music', 'nur', 'pharma', 'sc', 'sci', 'shs', 'gensan'
     ]
 
+VALID_COLLEGES = frozenset(get_valid_colleges())
+EMAIL_UNIT_PATTERN = r'^(?:[^@]*\.){2}([^@.]*)@'  # last part of a username with at least three parts
+EMAIL_COLLEGES = sorted([college.upper() for college in VALID_COLLEGES] + ['Others', 'Non-UST'])  # classify_emails 'College' values
+COLLEGE_BY_UNIT = {code: code.upper() for code in VALID_COLLEGES}  # email unit -> College
+
 def extract_college_unit(email):
     """Extract college/unit from email address."""
     if not isinstance(email, str) or '@ust.edu.ph' not in email:
@@ -240,9 +976,8 @@ def extract_college_unit(email):
             return 'Others'
             
         college = parts[-1].lower()  # Get the last part (college abbreviation)
-        valid_colleges = get_valid_colleges()
         
-        if college in valid_colleges:
+        if college in VALID_COLLEGES:
             return college.upper()
         else:
             return 'Others'
@@ -270,28 +1005,194 @@ def is_ust_student(email):
             
         # Get the academic unit (last part before @)
         academic_unit = parts[-1].lower()  
-        valid_units = get_valid_colleges()
         
         # Check if it's a valid academic unit
-        return academic_unit in valid_units
+        return academic_unit in VALID_COLLEGES
             
     except Exception:
         return False
 
+def classify_emails(emails):
+    """
+    Vectorized is_ust_student and extract_college_unit.
+    
+    Each distinct email is parsed once, and both results come from the same
+    parse of the username.
+    
+    Parameters:
+      emails (pd.Series): User emails
+    
+    Returns:
+      pd.DataFrame: 'College' (a categorical of EMAIL_COLLEGES) and
+        'is_ust_student' columns, aligned with `emails`, identical to
+        applying the two functions row by row
+    """
+    codes, uniques = pd.factorize(emails)
+    uniques = pd.Series(uniques, dtype=object)
+    
+    # Check for a UST address, then take the academic unit from a
+    # firstname.lastname.unit username (the part after its last dot)
+    is_ust = uniques.str.contains('@ust.edu.ph', regex=False).fillna(False).to_numpy(dtype=bool)
+    unit = uniques[is_ust].str.extract(EMAIL_UNIT_PATTERN, expand=False).str.lower()
+    
+    non_ust = EMAIL_COLLEGES.index('Non-UST')
+    college = np.full(len(uniques), non_ust, dtype=np.int8)
+    college[is_ust] = pd.Categorical(unit.map(COLLEGE_BY_UNIT).fillna('Others'),
+                                     categories=EMAIL_COLLEGES).codes
+    is_student = np.zeros(len(uniques), dtype=bool)
+    is_student[is_ust] = unit.isin(VALID_COLLEGES).to_numpy()
+    
+    # Missing emails (code -1) are not UST addresses
+    college = np.append(college, non_ust)[codes]
+    is_student = np.append(is_student, False)[codes]
+    return pd.DataFrame({'College': pd.Categorical.from_codes(college, EMAIL_COLLEGES), 'is_ust_student': is_student},
+                        index=emails.index)
+
+def pack_strings(values):
+    """
+    Encode strings as one UTF-8 byte array plus an array of offsets, a
+    compact layout that numpy can save without pickling.
+    
+    Returns:
+    tuple: (uint8 data, int64 offsets with len(values) + 1 entries)
+    """
+    encoded = [str(value).encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(data, offsets):
+    """Decode the output of pack_strings back into an object array of strings."""
+    buffer = data.tobytes()
+    strings = np.empty(len(offsets) - 1, dtype=object)
+    strings[:] = [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    return strings
+
+class FirstUsageAggregator:
+    """
+    Mergeable per-user first app usage.
+    
+    Keeps one record per user: the earliest Timestamp, with the Adobe App
+    (and College, when the input has it) from that row. Rows without a
+    Timestamp sort after timestamped ones, and ties go to the row seen
+    first, so without timestamps this is the first row seen per user.
+    
+    Chunks are folded in with add(); aggregators built from different files
+    or workers are combined with merge(). Memory scales with the number of
+    distinct users, not with the number of log rows.
+    """
+    
+    RECORD_COLUMNS = ['Adobe App', 'College']
+    
+    def __init__(self):
+        self._records = None
+        self._rows_seen = {}
+    
+    def add(self, chunk, source=0):
+        """
+        Fold a chunk of log rows into the aggregate.
+        
+        Parameters:
+          chunk (pd.DataFrame): Rows with 'User Email', 'Adobe App' and
+            optionally 'Timestamp' and 'College'.
+          source (int): Position of the file the chunk came from. Rows are
+            ordered by source, then by the order they were added.
+        """
+        if chunk.empty:
+            return
+        
+        start = self._rows_seen.get(source, 0)
+        self._rows_seen[source] = start + len(chunk)
+        
+        # Find each user's first row on integer codes, so strings are only
+        # taken for those rows
+        user_codes, _ = pd.factorize(chunk['User Email'])
+        order = pd.DataFrame({
+            'Timestamp': chunk['Timestamp'].to_numpy() if 'Timestamp' in chunk.columns else pd.NaT,
+            'user': user_codes,
+        })
+        first = np.sort(order.sort_values('Timestamp', na_position='last', kind='mergesort')
+                        .drop_duplicates('user').index.to_numpy())
+        
+        records = pd.DataFrame({
+            'User Email': chunk['User Email'].iloc[first].to_numpy(),
+            'Timestamp': order['Timestamp'].to_numpy()[first],
+        })
+        for column in self.RECORD_COLUMNS:
+            if column in chunk.columns:
+                records[column] = chunk[column].values[first]
+        records['_source'] = source
+        records['_row'] = start + first
+        self._fold(records)
+    
+    def merge(self, other):
+        """Fold another aggregator's records into this one."""
+        if other._records is not None:
+            self._fold(other._records)
+        for source, rows in other._rows_seen.items():
+            self._rows_seen[source] = max(self._rows_seen.get(source, 0), rows)
+    
+    def _fold(self, records):
+        if self._records is not None:
+            records = pd.concat([self._records, records], ignore_index=True, sort=False)
+        records = records.sort_values(['Timestamp', '_source', '_row'], na_position='last', kind='mergesort')
+        self._records = records.drop_duplicates('User Email', keep='first')
+    
+    def __len__(self):
+        return 0 if self._records is None else len(self._records)
+    
+    def to_arrays(self):
+        """Return the aggregate as a dict of numpy arrays, for AnalysisState."""
+        arrays = {
+            'rows_seen_sources': np.array(list(self._rows_seen), dtype=np.int64),
+            'rows_seen_rows': np.array(list(self._rows_seen.values()), dtype=np.int64),
+        }
+        if self._records is not None:
+            arrays['users'], arrays['users_offsets'] = pack_strings(self._records['User Email'])
+            arrays['timestamps'] = self._records['Timestamp'].to_numpy(dtype='datetime64[ns]')
+            for column in self.RECORD_COLUMNS:
+                if column in self._records.columns:
+                    arrays[column], arrays[column + '_offsets'] = pack_strings(self._records[column])
+            arrays['sources'] = self._records['_source'].to_numpy(dtype=np.int64)
+            arrays['rows'] = self._records['_row'].to_numpy(dtype=np.int64)
+        return arrays
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild an aggregator saved with to_arrays()."""
+        aggregator = cls()
+        aggregator._rows_seen = dict(zip(arrays['rows_seen_sources'].tolist(), arrays['rows_seen_rows'].tolist()))
+        if 'users' in arrays:
+            records = pd.DataFrame({
+                'User Email': unpack_strings(arrays['users'], arrays['users_offsets']),
+                'Timestamp': arrays['timestamps'],
+            })
+            for column in cls.RECORD_COLUMNS:
+                if column in arrays:
+                    records[column] = unpack_strings(arrays[column], arrays[column + '_offsets'])
+            records['_source'] = arrays['sources']
+            records['_row'] = arrays['rows']
+            aggregator._records = records
+        return aggregator
+    
+    def result(self):
+        """Return one row per user, sorted by 'User Email'."""
+        if self._records is None:
+            return pd.DataFrame(columns=['User Email', 'Timestamp'] + self.RECORD_COLUMNS[:1])
+        return (self._records.drop(columns=['_source', '_row'])
+                .sort_values('User Email')
+                .reset_index(drop=True))
+
 def process_user_app_data(ust_df):
     """
     Process the first app usage for each student.
     Extracts and returns user-college-app mapping.
-    """
-    # Make a copy to avoid modifying the original dataframe
-    df_copy = ust_df.copy()
     
-    # Sort by timestamp if available to get first genuine app usage
-    if 'Timestamp' in df_copy.columns:
-        df_copy = df_copy.sort_values('Timestamp')
-    
-    # Use groupby to efficiently get first app usage per user
-    first_usage = df_copy.groupby('User Email').first().reset_index()
+    ust_df may be raw log rows or an already aggregated first-usage table.
+    """
+    aggregator = FirstUsageAggregator()
+    aggregator.add(ust_df)
+    first_usage = aggregator.result()
     
     # Create result dataframe
     result_df = first_usage[['User Email', 'Adobe App', 'College']]
@@ -321,27 +1222,155 @@ def get_highest_app_users(college_df, apps):
     highest_users = sorted(highest_users, key=lambda x: x[2], reverse=True)
     return highest_users
 
-def create_college_app_matrix(first_app_usage, valid_colleges, apps):
-    """Create the college by app matrix for reporting."""
-    college_app_matrix = []
+def count_college_apps(first_app_usage, colleges, apps):
+    """
+    Count first app usage per college and app in one pass.
+    
+    Parameters:
+      first_app_usage (pd.DataFrame): One row per user with 'Adobe App'
+        and 'College'
+      colleges (list): Colleges to count, in column order; users from
+        other colleges are left out
+      apps (list): Apps that get a row even when nobody used them
+    
+    Returns:
+      pd.DataFrame: User counts with one row per app - the apps seen,
+        sorted, then the unseen ones from `apps` - and one column per college
+    """
+    college_codes = pd.Categorical(first_app_usage['College'], categories=colleges).codes
+    counted = college_codes >= 0
+    college_codes = college_codes[counted]
+    
+    # Only apps used by counted users are "seen"
+    app_codes, seen_apps = pd.factorize(first_app_usage['Adobe App'][counted], sort=True)
+    seen = set(seen_apps)
+    app_index = list(seen_apps) + [app for app in apps if app not in seen]
+    
+    # Count every (app, college) pair with a single bincount
+    keep = app_codes >= 0
+    pairs = app_codes[keep] * len(colleges) + college_codes[keep]
+    counts = np.bincount(pairs, minlength=len(app_index) * len(colleges))
     
+    return pd.DataFrame(
+        counts.reshape(len(app_index), len(colleges)),
+        index=pd.Index(app_index, name='Adobe App'),
+        columns=pd.Index(colleges, name='College'),
+    )
+
+def create_college_app_matrix(app_counts, valid_colleges, apps):
+    """
+    Create the college by app matrix for reporting.
+    
+    Parameters:
+      app_counts (pd.DataFrame): Counts from count_college_apps
+      valid_colleges (list): Colleges, one matrix row each
+      apps (list): Apps, one matrix column each after College and
+        Total Unique Users
+    """
+    college_totals = app_counts.sum(axis=0)
+    per_app = app_counts.loc[apps]
+    
+    college_app_matrix = []
     for college in valid_colleges:
-        college_users = first_app_usage[first_app_usage['College'] == college]
-        college_unique_users = len(college_users)
-        row = [college, college_unique_users]  # College name and total unique users
-        
-        # Count for each app
-        for app in apps:
-            app_users = len(college_users[college_users['Adobe App'] == app])
-            row.append(app_users)
-        
+        row = [college, int(college_totals[college])]  # College name and total unique users
+        row.extend(per_app[college].tolist())
         college_app_matrix.append(row)
     
     return college_app_matrix
 
-def generate_college_usage_stats(df, output_folder):
-    """Generate individual Excel files with college-wise Adobe app usage statistics."""
+def write_sheet_openpyxl(path, sheet_name, frame, index):
+    """Write a report sheet through pandas' ExcelWriter (full openpyxl workbook)."""
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        frame.to_excel(writer, sheet_name=sheet_name, index=index)
+
+def write_sheet_streaming(path, sheet_name, frame, index):
+    """
+    Write a report sheet with openpyxl's write-only workbook.
+    
+    Rows are streamed to the file instead of being kept as cell objects, so
+    memory stays flat for long sheets. Cell values and the header style
+    match pandas' to_excel. The index, when wanted, is written as the first
+    column under its name.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font, Border, Side
+    
+    if index:
+        frame = frame.reset_index()
+    
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet_name)
+    
+    # Header row styled like pandas' to_excel
+    header_border = Border(*(Side(style='thin') for _ in range(4)))
+    header = []
+    for column in frame.columns:
+        cell = WriteOnlyCell(worksheet, value=str(column))
+        cell.font = Font(bold=True)
+        cell.border = header_border
+        cell.alignment = Alignment(horizontal='center', vertical='top')
+        header.append(cell)
+    worksheet.append(header)
+    
+    # Missing values become empty cells, as with to_excel
+    values = frame.astype(object).where(frame.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        worksheet.append(row)
+    
+    workbook.save(path)
+
+REPORT_WRITERS = {
+    'openpyxl': write_sheet_openpyxl,
+    'streaming': write_sheet_streaming,
+}
+
+def write_report(path, sheet_name, frame, index=False, writer=None, timer=None):
+    """
+    Write a DataFrame as a single-sheet report file.
+    
+    Parameters:
+      path (str): Output .xlsx path
+      sheet_name (str): Name of the sheet
+      frame (pd.DataFrame): Report contents
+      index (bool): Whether to write the index as the first column
+      writer (str): Key of REPORT_WRITERS; defaults to REPORT_WRITER, where
+        'auto' streams sheets of REPORT_STREAMING_ROWS rows or more
+      timer (StageTimer): Optional timer for a 'write <file>' stage
+    """
+    writer = writer or REPORT_WRITER
+    if writer == 'auto':
+        writer = 'streaming' if len(frame) >= REPORT_STREAMING_ROWS else 'openpyxl'
+    
+    timer = timer or StageTimer()
+    start = time.time()
+    with timer.stage(f"write {os.path.basename(path)}", rows=len(frame)):
+        REPORT_WRITERS[writer](path, sheet_name, frame, index)
+    logger.info(f"Wrote {os.path.basename(path)} ({len(frame)} rows, {writer}) in {time.time() - start:.2f}s")
+
+def write_reports(reports, workers=None, timer=None):
+    """
+    Write several report files at the same time.
+    
+    Parameters:
+      reports (list): (path, sheet_name, frame, index) tuples
+      workers (int): Number of files written at once; defaults to REPORT_WORKERS
+      timer (StageTimer): Optional timer for the writes
+    """
+    with ThreadPoolExecutor(max_workers=workers or REPORT_WORKERS) as executor:
+        futures = [executor.submit(write_report, *report, timer=timer) for report in reports]
+        for future in futures:
+            future.result()
+
+def generate_college_usage_stats(df, output_folder, timer=None):
+    """
+    Generate individual Excel files with college-wise Adobe app usage statistics.
+    
+    Stages are timed on `timer` (a StageTimer, possibly already holding the
+    ingestion stages), and its breakdown is returned as preview_data['timings'].
+    """
     logger.info("Generating college usage statistics...")
+    timer = timer or StageTimer()
     
     try:
         # Create output folder if it doesn't exist
@@ -351,13 +1380,26 @@ def generate_college_usage_stats(df, output_folder):
         # Get row count metrics from the dataframe attributes
         total_rows = getattr(df, 'total_rows', len(df))
         duplicate_rows = getattr(df, 'duplicate_rows', 0)
+        duplicate_rows_approximate = getattr(df, 'duplicate_rows_approximate', False)
+        file_details = df.attrs.get('files', [])
+        
+        # First app usage per user; df may be raw log rows or the per-user
+        # table returned by process_saved_files
+        with timer.stage('first usage', rows=len(df)):
+            aggregator = FirstUsageAggregator()
+            aggregator.add(df)
+            first_usage = aggregator.result()
         
-        # Apply the new student classification
-        df['is_ust_student'] = df['User Email'].apply(is_ust_student)
+        # Apply the new student classification; first_usage is our own
+        # table, so the columns are set in place rather than joined into a copy
+        with timer.stage('classify emails', rows=len(first_usage)):
+            email_classes = classify_emails(first_usage['User Email'])
+            first_usage['College'] = email_classes['College']
+            first_usage['is_ust_student'] = email_classes['is_ust_student']
         
-        # Ensure we're counting unique users correctly
-        total_users = df['User Email'].nunique()
-        ust_student_users = df[df['is_ust_student']]['User Email'].nunique()
+        # Each user appears once in first_usage
+        total_users = len(first_usage)
+        ust_student_users = int(first_usage['is_ust_student'].sum())
         other_users = total_users - ust_student_users
         
         logger.info(f"Processing statistics for {total_users} unique users")
@@ -375,60 +1417,32 @@ def generate_college_usage_stats(df, output_folder):
                 other_users
             ]
         })
-        
-        with pd.ExcelWriter(overall_stats_file, engine='openpyxl') as writer:
-            stats_df.to_excel(writer, sheet_name='Overall Statistics', index=False)
-            # No formatting applied
+        reports = [(overall_stats_file, 'Overall Statistics', stats_df, False)]
         
         # File 2: College Distribution - restructured with pivot
         college_dist_file = os.path.join(output_folder, 'college_distribution.xlsx')
         
-        # Filter UST student emails and extract college
-        ust_df = df[df['is_ust_student']].copy()
-        ust_df['College'] = ust_df['User Email'].apply(extract_college_unit)
-        
-        # Process user app data
-        first_app_usage = process_user_app_data(ust_df)
-        
         # Get unique colleges and apps
         valid_colleges = [college.upper() for college in get_valid_colleges()]
-        apps = get_all_adobe_apps()
-        
-        # Create a pivot table style DataFrame
-        # First, count app usage per college
-        app_counts = pd.pivot_table(
-            first_app_usage, 
-            values='User Email', 
-            index='Adobe App', 
-            columns='College', 
-            aggfunc='count', 
-            fill_value=0
-        )
-        
-        # Ensure all valid colleges are included
-        for college in valid_colleges:
-            if college not in app_counts.columns:
-                app_counts[college] = 0
-        
-        # Ensure all apps are included
-        for app in apps:
-            if app not in app_counts.index:
-                app_counts.loc[app] = 0
+        apps = df.attrs.get('adobe_apps') or get_all_adobe_apps()
+        
+        # Count app usage per college once; the distribution sheet, the
+        # highest-college table and the preview all come from these counts.
+        # Only UST students have one of valid_colleges, so count_college_apps
+        # leaves everyone else out without a filtered copy.
+        with timer.stage('count colleges', rows=ust_student_users):
+            app_counts = count_college_apps(first_usage, valid_colleges, apps)
         
         # Reorder columns by college codes
-        app_counts = app_counts[sorted(app_counts.columns)]
+        college_distribution = app_counts[sorted(valid_colleges)]
         
         # Save college distribution to its own Excel file
-        with pd.ExcelWriter(college_dist_file, engine='openpyxl') as writer:
-            app_counts.to_excel(writer, sheet_name='College Distribution')
-            # No formatting applied
+        reports.append((college_dist_file, 'College Distribution', college_distribution, True))
         
         # File 3: Highest College Users Per App - without formatting
         highest_app_file = os.path.join(output_folder, 'highest_college_users_per_app.xlsx')
         
-        # For this file, we'll use the original app counting approach
-        # since we need to identify the highest college per app
-        college_app_matrix = create_college_app_matrix(first_app_usage, valid_colleges, apps)
+        college_app_matrix = create_college_app_matrix(app_counts, valid_colleges, apps)
         columns = ['College', 'Total Unique Users'] + apps
         college_df = pd.DataFrame(college_app_matrix, columns=columns)
         
@@ -437,29 +1451,38 @@ def generate_college_usage_stats(df, output_folder):
         highest_users_df = pd.DataFrame(highest_users, columns=['Adobe App', 'Highest College', 'Total HCU'])
         
         # Save highest users per app to its own Excel file without formatting
-        with pd.ExcelWriter(highest_app_file, engine='openpyxl') as writer:
-            highest_users_df.to_excel(writer, sheet_name='Highest College Users', index=False)
-            # No formatting applied
+        reports.append((highest_app_file, 'Highest College Users', highest_users_df, False))
         
         # File 4: Other Users (non-student users)
         other_users_file = os.path.join(output_folder, 'other_users.xlsx')
         
-        other_users_df = df[~df['is_ust_student']].copy()
-        if 'Timestamp' in other_users_df.columns:
-            other_users_df = other_users_df.sort_values('Timestamp')
-        
-        # More efficient way to get first app usage
-        if not other_users_df.empty:
-            other_first_usage = other_users_df.groupby('User Email').first().reset_index()
-            other_users_summary = other_first_usage[['User Email', 'Adobe App']].rename(
-                columns={'Adobe App': 'First Adobe App Used'})
-            other_users_summary = other_users_summary.sort_values('User Email')
+        if other_users:
+            # first_usage is sorted by email already
+            is_other = ~first_usage['is_ust_student'].to_numpy()
+            other_users_summary = pd.DataFrame({
+                'User Email': first_usage['User Email'].to_numpy()[is_other],
+                'First Adobe App Used': first_usage['Adobe App'].to_numpy()[is_other],
+            })
             
             # Write others to separate file without formatting
-            with pd.ExcelWriter(other_users_file, engine='openpyxl') as writer:
-                other_users_summary.to_excel(writer, sheet_name='Other Users', index=False)
-                # No formatting applied
-            
+            reports.append((other_users_file, 'Other Users', other_users_summary, False))
+        
+        # File 5: Monthly active users per app, from the run's UsageRollup
+        usage_rollup = getattr(df, 'usage_rollup', None)
+        has_usage_trends = usage_rollup is not None and len(usage_rollup) > 0
+        if has_usage_trends:
+            with timer.stage('usage trends', rows=len(usage_rollup)):
+                trends = usage_trends(usage_rollup, period='month', by='app')
+                monthly_users = trends.pivot(index='Period', columns='Adobe App', values='Users').fillna(0).astype(int)
+                monthly_users.index = monthly_users.index.strftime('%Y-%m')
+                monthly_users.index.name = 'Month'
+                monthly_users.columns.name = None
+            reports.append((os.path.join(output_folder, 'usage_trends.xlsx'), 'Monthly Active Users',
+                            monthly_users, True))
+        
+        # Write the report files concurrently
+        write_reports(reports, timer=timer)
+        
         # Format data for template display
         # Use the original college_df for display purposes
         highest_users_per_app = [(app, college, count) for app, college, count in highest_users if count > 0]
@@ -486,9 +1509,13 @@ def generate_college_usage_stats(df, output_folder):
             "other_users": other_users,
             "total_rows": total_rows,
             "duplicate_rows": duplicate_rows,
+            "duplicate_rows_approximate": duplicate_rows_approximate,
+            "files": file_details,
+            "has_usage_trends": has_usage_trends,
             "all_colleges": actual_colleges_dict,
             "highest_users_per_app": sorted(highest_users_per_app, key=lambda x: x[2], reverse=True),
-            "highest_users_per_college": sorted(highest_users_per_college, key=lambda x: x[1], reverse=True)
+            "highest_users_per_college": sorted(highest_users_per_college, key=lambda x: x[1], reverse=True),
+            "timings": timer.breakdown()
         }
             
         return True, preview_data
@@ -497,233 +1524,2213 @@ def generate_college_usage_stats(df, output_folder):
         logger.error(f"Error generating college usage statistics: {str(e)}", exc_info=True)
         return False, {}
       
-def process_files(files):
-    """
-    Process uploaded files and return a combined DataFrame with Adobe app detection.
-    Ensures proper concatenation of all records and tracks duplicate rows.
-    Also identifies users that appear in multiple files.
+# Byte order marks, longest first (the UTF-32 LE mark starts with the UTF-16 LE one)
+CSV_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+def detect_csv_encoding(file_path):
     """
-    # Initialize tracking variables
-    all_dataframes = []
-    total_rows_before = 0
-    users_per_file = {}
+    Pick the encoding of a CSV upload before it is parsed.
     
-    # Process each file
-    for i, file in enumerate(files):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
+    A byte order mark decides directly. Otherwise the file is run through
+    an incremental UTF-8 decoder in blocks of ENCODING_BLOCK_SIZE bytes,
+    stopping at the first byte that is not UTF-8; such files are read as
+    CSV_FALLBACK_ENCODING, which needs no scan because it decodes any byte.
+    This is one plain byte scan, much cheaper than parsing, and a bad byte
+    near the end of a large file cannot force a second parse.
+    """
+    with open(file_path, 'rb') as f:
+        head = f.read(4)
+        for bom, encoding in CSV_BOMS:
+            if head.startswith(bom):
+                return encoding
         
+        decoder = codecs.getincrementaldecoder(CSV_ENCODING)()
         try:
-            # Save file to disk
-            file.save(file_path)
+            decoder.decode(head)
+            for block in iter(lambda: f.read(ENCODING_BLOCK_SIZE), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return CSV_FALLBACK_ENCODING
+    return CSV_ENCODING
+
+def string_categories(values, strip=False):
+    """
+    Return values as a categorical of strings, rendered the way astype(str)
+    renders them (missing values become 'nan') and optionally stripped.
+    
+    The conversion runs once per distinct value. Categories are sorted, so
+    sorting the result orders it like the plain strings.
+    """
+    codes, uniques = pd.factorize(values)
+    labels = [str(value) for value in uniques] + ['nan']  # code -1 (missing) picks the last label
+    if strip:
+        labels = [label.strip() for label in labels]
+    label_codes, categories = pd.factorize(np.array(labels, dtype=object), sort=True)
+    return pd.Categorical.from_codes(label_codes[codes], categories)
+
+def parse_timestamps(values):
+    """
+    Parse a Timestamp column into naive UTC datetime64.
+    
+    Timestamps with an offset are converted to UTC and ones without are
+    taken as UTC. Values that can't be parsed become NaT, which sorts like
+    a missing timestamp.
+    """
+    parsed = pd.to_datetime(values, errors='coerce', utc=True, **TIMESTAMP_PARSE_OPTIONS).dt.tz_convert(None)
+    unparsed = int((parsed.isna() & values.notna()).sum())
+    if unparsed:
+        logger.warning(f"{unparsed} timestamps could not be parsed and are treated as missing")
+    return parsed
+
+def prepare_chunk(chunk, timer=None, rules=None, hits=None):
+    """
+    Reduce a chunk of an upload to the analysis columns and label its apps.
+    
+    Missing columns are filled the way pd.concat would fill them, so chunks
+    from files with different layouts combine as before. Labelling is timed
+    as 'classify apps' on `timer`, if given; `rules` and `hits` go to
+    detect_adobe_apps.
+    """
+    timer = timer or StageTimer()
+    prepared = pd.DataFrame(index=chunk.index)
+    for column in REQUIRED_COLUMNS:
+        values = chunk[column] if column in chunk.columns else pd.Series(np.nan, index=chunk.index)
+        prepared[column] = string_categories(values, strip=column == 'User Email')
+    if 'Timestamp' in chunk.columns:
+        prepared['Timestamp'] = parse_timestamps(chunk['Timestamp'])
+    else:
+        prepared['Timestamp'] = pd.Series(pd.NaT, index=chunk.index, dtype='datetime64[ns]')
+    with timer.stage('classify apps', rows=len(prepared)):
+        prepared['Adobe App'] = detect_adobe_apps(prepared['Item Path'], persist=False, rules=rules, hits=hits)
+    return prepared
+
+capture_lock = threading.Lock()  # capture_skipped_lines swaps the process-wide stderr and warning filters
+
+@contextmanager
+def capture_skipped_lines():
+    """
+    Collect the line numbers of malformed CSV lines skipped by read_csv.
+    
+    Depending on the pandas version, on_bad_lines='warn' reports each
+    skipped line on stderr or as a ParserWarning; both are captured here.
+    pandas 1.3 has no callback for bad lines, so this swaps process-wide
+    state: captures run one at a time under capture_lock, and other
+    warnings and stderr output of the meantime are passed on. Yields the
+    list the numbers go to.
+    """
+    skipped = []
+    messages = io.StringIO()
+    with capture_lock:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with redirect_stderr(messages):
+                yield skipped
+    
+    for warning in caught:
+        if issubclass(warning.category, pd.errors.ParserWarning):
+            messages.write(str(warning.message) + '\n')
+        else:
+            warnings.warn_explicit(warning.message, warning.category, warning.filename, warning.lineno)
+    for line in messages.getvalue().splitlines(keepends=True):
+        found = re.findall(r'Skipping line (\d+)', line)
+        if found:
+            skipped.extend(int(number) for number in found)
+        elif line.strip():
+            sys.stderr.write(line)
+
+class ProbedCsv:
+    """
+    Text stream over a CSV file that inserts an empty probe line, with one
+    field more than the header, right after the header.
+    
+    read_csv validates usecols against the widest line it has seen, so the
+    probe lets EXTRA_FIELD_COLUMN be named even when no line is too long.
+    The probe is row 0 of the parsed data.
+    
+    Parameters:
+    file_path (str): CSV file to read
+    encoding (str): Encoding of the file
+    fields (int): Number of fields in the header
+    """
+    def __init__(self, file_path, encoding, fields):
+        self.handle = open(file_path, encoding=encoding, newline='')
+        self.pending = self.handle.readline() + ',' * fields + '\n'
+    
+    def read(self, size=-1):
+        if self.pending:
+            data, self.pending = self.pending, ''
+            return data
+        return self.handle.read(size)
+    
+    def __iter__(self):  # read_csv only accepts file-like objects that are iterable
+        return self
+    
+    def __next__(self):
+        line = self.read() if self.pending else self.handle.readline()
+        if not line:
+            raise StopIteration
+        return line
+    
+    def close(self):
+        self.handle.close()
+
+def read_csv_chunks(file_path, encoding, chunksize=CSV_CHUNK_SIZE, skipped_lines=None):
+    """
+    Yield (header columns, chunk) pairs from a CSV upload, parsed with the
+    C engine.
+    
+    The header is read first, and only the INGEST_COLUMNS it has are
+    parsed (usecols), with 'User Email' and 'Item Path' loaded straight
+    into categoricals. With usecols pandas keeps lines that have too many
+    fields, so one extra column (EXTRA_FIELD_COLUMN) is named past the
+    header to catch them (see ProbedCsv); a malformed line raises
+    pd.errors.ParserError.
+    
+    Passing a list as skipped_lines makes the read tolerant instead: every
+    column is parsed, malformed lines are skipped and their line numbers
+    appended to the list.
+    """
+    header = list(pd.read_csv(file_path, nrows=0, encoding=encoding).columns)
+    columns = set(header)
+    ingest_columns = [column for column in INGEST_COLUMNS if column in columns]
+    options = {'dtype': {'User Email': 'category', 'Item Path': 'category'}, 'encoding': encoding}
+    source = file_path
+    if skipped_lines is None:
+        source = ProbedCsv(file_path, encoding, len(header))
+        options.update(names=header + [EXTRA_FIELD_COLUMN], header=0,
+                       usecols=ingest_columns + [EXTRA_FIELD_COLUMN])
+    else:
+        options.update(on_bad_lines='warn')
+    
+    with pd.read_csv(source, chunksize=chunksize, **options) as reader:
+        while True:
+            # Only a tolerant read reports skipped lines
+            if skipped_lines is not None:
+                with capture_skipped_lines() as skipped:
+                    chunk = next(reader, None)
+                skipped_lines.extend(skipped)
+            else:
+                chunk = next(reader, None)
+            if chunk is None:
+                return
+            if skipped_lines is None:
+                # Check for lines with one field too many (more raise in the parser)
+                extra = chunk[EXTRA_FIELD_COLUMN].notna()
+                if extra.any():
+                    line = chunk.index[extra][0] + 1  # 1-based with the header, less the probe line
+                    raise pd.errors.ParserError(f"Expected {len(header)} fields in line {line}, saw more")
+                chunk = chunk.drop(index=0, errors='ignore')  # the probe line
+            yield columns, chunk[ingest_columns]
+
+def read_excel_chunks(file_path, chunksize=CSV_CHUNK_SIZE):
+    """
+    Yield (header columns, chunk) pairs from an XLSX upload, streaming rows
+    from a read-only openpyxl workbook.
+    
+    Every worksheet is read, with its first row as the header. Only the
+    INGEST_COLUMNS found there (by name) are kept. Sheets that have none of
+    the REQUIRED_COLUMNS (notes, pivot summaries) are skipped. If no sheet
+    has them, the first header is still yielded with an empty chunk, so the
+    missing columns get reported. Like read_excel, fully blank rows are
+    skipped.
+    """
+    from openpyxl import load_workbook
+    
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        first_columns = None
+        ingested = False
+        for sheet in workbook.worksheets:
+            sheet.reset_dimensions()  # some exporters write a wrong sheet size
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None) or ()
+            positions = {}
+            for position, name in enumerate(header):
+                if name in INGEST_COLUMNS:
+                    positions.setdefault(name, position)
+            columns = {str(name) for name in header if name is not None}
+            if first_columns is None:
+                first_columns = columns
             
-            # Read the file based on its extension
-            df = None
-            if filename.endswith('.csv'):
-                # Try different encodings
-                encodings = ['utf-8', 'latin1', 'cp1252']
-                for encoding in encodings:
-                    try:
-                        df = pd.read_csv(file_path, encoding=encoding, low_memory=False)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                    except Exception as e:
-                        logger.warning(f"Error reading {filename} with {encoding} encoding: {str(e)}")
-                
-                # If all encodings failed, try with Python engine as last resort
-                if df is None:
-                    df = pd.read_csv(file_path, encoding='utf-8', on_bad_lines='skip', engine='python')
-            else:  # .xlsx
-                df = pd.read_excel(file_path)
+            # Check whether the sheet holds log rows at all
+            if not any(column in positions for column in REQUIRED_COLUMNS):
+                logger.info(f"Skipping sheet '{sheet.title}' of {os.path.basename(file_path)}: no "
+                            f"{' or '.join(REQUIRED_COLUMNS)} column")
+                continue
+            ingested = True
             
-            # Track row counts and users
-            total_rows_before += len(df)
+            names = list(positions)
+            batch = []
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                batch.append([row[positions[name]] if positions[name] < len(row) else None for name in names])
+                if len(batch) == chunksize:
+                    yield columns, pd.DataFrame(batch, columns=names, dtype=object)
+                    batch = []
+            if batch:
+                yield columns, pd.DataFrame(batch, columns=names, dtype=object)
+        
+        if not ingested:
+            yield first_columns or set(), pd.DataFrame(columns=REQUIRED_COLUMNS, dtype=object)
+    finally:
+        workbook.close()
+
+class DistinctKeyCounter:
+    """
+    Incremental count of distinct (User Email, Item Path) pairs.
+    
+    Each pair is reduced to a 64-bit hash, so no copy of the key columns is
+    kept: a chunk's emails and paths are factorized, only their distinct
+    values are hashed, and the pair hash is mixed from the two. In exact
+    mode the distinct pair hashes are kept; a false match needs two pairs
+    with the same 64-bit hash, which is negligible at log sizes. In
+    approximate mode only a HyperLogLog sketch of 2**precision one-byte
+    registers is kept, whatever the input size.
+    
+    Counters for chunks, files or workers are combined with merge().
+    """
+    
+    KEY_COLUMNS = ['User Email', 'Item Path']
+    HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+    MISSING_HASH = np.uint64(0x5F1E55C0FFEE)  # hash used for NaN keys
+    
+    def __init__(self, approximate=None, precision=DUPLICATE_HLL_PRECISION):
+        if approximate is None:
+            approximate = DUPLICATE_COUNT_MODE == 'approximate'
+        self.approximate = approximate
+        self.precision = precision
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._pending = []
+        self._pending_size = 0
+        self._registers = np.zeros(1 << precision, dtype=np.uint8) if approximate else None
+    
+    def add(self, chunk):
+        """Add the key pairs of a chunk of log rows."""
+        # Hash each distinct email and path once. Codes are shifted by one so
+        # NaN (code -1) becomes 0 and picks MISSING_HASH, and every code is
+        # non-negative when the two are combined below
+        codes, hashes = [], []
+        for column in self.KEY_COLUMNS:
+            column_codes, uniques = pd.factorize(chunk[column])
+            codes.append(column_codes.astype(np.int64) + 1)
+            hashes.append(np.insert(pd.util.hash_array(np.asarray(uniques, dtype=object), categorize=False),
+                                    0, self.MISSING_HASH))
+        
+        # Distinct pairs of the chunk, then one mixed hash per pair
+        # (width is the number of distinct paths plus one, for NaN)
+        width = len(hashes[1])
+        pairs = pd.unique(codes[0] * width + codes[1])
+        pair_hashes = hashes[0][pairs // width] * self.HASH_MIX + hashes[1][pairs % width]
+        
+        if self.approximate:
+            self._add_to_sketch(pair_hashes)
+        else:
+            self._add_hashes(pair_hashes)
+    
+    def merge(self, other):
+        """Fold another counter (same mode) into this one."""
+        if self.approximate:
+            np.maximum(self._registers, other._registers, out=self._registers)
+        else:
+            for hashes in [other._hashes] + other._pending:
+                self._add_hashes(hashes)
+    
+    def count(self):
+        """Return the number of distinct pairs seen (an estimate in approximate mode)."""
+        if self.approximate:
+            return self._estimate()
+        self._compact()
+        return len(self._hashes)
+    
+    def to_arrays(self):
+        """Return the distinct hashes (or the sketch) as numpy arrays, for AnalysisState."""
+        if self.approximate:
+            return {'registers': self._registers}
+        self._compact()
+        return {'hashes': self._hashes}
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a counter saved with to_arrays()."""
+        if 'registers' in arrays:
+            counter = cls(approximate=True, precision=int(np.log2(len(arrays['registers']))))
+            counter._registers = arrays['registers'].copy()
+        else:
+            counter = cls(approximate=False)
+            counter._hashes = arrays['hashes']
+        return counter
+    
+    def _add_hashes(self, hashes):
+        self._pending.append(hashes)
+        self._pending_size += len(hashes)
+        # Compact once pending hashes outgrow the distinct ones, so each hash
+        # is deduplicated a bounded number of times
+        if self._pending_size > max(len(self._hashes), CSV_CHUNK_SIZE):
+            self._compact()
+    
+    def _compact(self):
+        if self._pending:
+            self._hashes = pd.unique(np.concatenate([self._hashes] + self._pending))
+            self._pending = []
+            self._pending_size = 0
+    
+    def _add_to_sketch(self, hashes):
+        # The top bits pick a register; the register keeps the highest rank
+        # (position of the first set bit) seen in the remaining bits
+        rest_bits = 64 - self.precision
+        registers = (hashes >> np.uint64(rest_bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # frexp gives floor(log2(rest)) + 1 exactly, as rest fits in a float64 mantissa
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        ranks = (rest_bits - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self._registers, registers, ranks)
+    
+    def _estimate(self):
+        m = len(self._registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self._registers == 0))
+        # Small-range correction (linear counting)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+class UsageRollup:
+    """
+    Per-day rollup of log rows: the distinct (day, User Email, Adobe App)
+    triples behind the usage trends.
+    
+    It holds one entry per user, app and active day, far fewer than the
+    log rows, and is exact. Each entry is a single uint64 key packing the
+    day with integer ids of the user and app, so no strings are kept per
+    entry. Rollups of chunks, files and earlier runs are combined with
+    merge(), and usage_trends() answers any date range and period from it.
+    Rows without a Timestamp are left out.
+    
+    Once the rollup is complete, finalize() counts the users of every
+    period and group up front, so trend queries only count the days of
+    periods cut by their date range.
+    """
+    DAY_OFFSET = 2 ** 19  # keys hold day + DAY_OFFSET, covering every datetime64[ns] day
+    USER_BITS = 32
+    APP_BITS = 12
+    
+    def __init__(self):
+        self._users = []  # user id -> email
+        self._user_ids = {}
+        self._apps = []  # app id -> app name
+        self._app_ids = {}
+        self._keys = np.empty(0, dtype=np.uint64)
+        self._pending = []
+        self._pending_size = 0
+        self._encoded = None
+        self._period_trends = {}
+    
+    @staticmethod
+    def _intern(values, ids, labels):
+        """Return the id of each value, giving new values the next ids."""
+        result = np.empty(len(values), dtype=np.uint64)
+        for i, value in enumerate(values):
+            value_id = ids.get(value)
+            if value_id is None:
+                value_id = ids[value] = len(labels)
+                labels.append(value)
+            result[i] = value_id
+        return result
+    
+    def _pack(self, days, user_ids, app_ids):
+        return (((days.astype(np.int64) + self.DAY_OFFSET).astype(np.uint64) << np.uint64(self.USER_BITS + self.APP_BITS))
+                | (user_ids.astype(np.uint64) << np.uint64(self.APP_BITS)) | app_ids.astype(np.uint64))
+    
+    def _unpack(self, keys):
+        """Return (days, user ids, app ids) of packed keys."""
+        days = (keys >> np.uint64(self.USER_BITS + self.APP_BITS)).astype(np.int64) - self.DAY_OFFSET
+        user_ids = ((keys >> np.uint64(self.APP_BITS)) & np.uint64(2 ** self.USER_BITS - 1)).astype(np.int64)
+        app_ids = (keys & np.uint64(2 ** self.APP_BITS - 1)).astype(np.int64)
+        return days, user_ids, app_ids
+    
+    def add(self, chunk):
+        """Add the triples of a chunk of prepared log rows."""
+        if 'Timestamp' not in chunk.columns:
+            return
+        timestamps = chunk['Timestamp'].to_numpy(dtype='datetime64[ns]')
+        dated = ~np.isnat(timestamps)
+        if not dated.any():
+            return
+        
+        # Ids from the chunk's codes; only its distinct users and apps are looked up
+        days = timestamps[dated].astype('datetime64[D]').astype(np.int64)
+        user_codes, users = pd.factorize(chunk['User Email'][dated])
+        app_codes, apps = pd.factorize(chunk['Adobe App'][dated])
+        user_ids = self._intern(list(users), self._user_ids, self._users)[user_codes]
+        app_ids = self._intern(list(apps), self._app_ids, self._apps)[app_codes]
+        self._add(pd.unique(self._pack(days, user_ids, app_ids)))
+    
+    def merge(self, other):
+        """Fold another rollup into this one."""
+        other._compact()
+        if not len(other._keys):
+            return
+        user_ids = self._intern(other._users, self._user_ids, self._users)
+        app_ids = self._intern(other._apps, self._app_ids, self._apps)
+        days, other_users, other_apps = other._unpack(other._keys)
+        keys = self._pack(days, user_ids[other_users], app_ids[other_apps])
+        
+        # Renumbering keeps distinct keys distinct, so an empty rollup takes them as they are
+        if not len(self._keys) and not self._pending:
+            self._keys = np.sort(keys)
+            self._encoded = None
+            self._period_trends = {}
+        else:
+            self._add(keys)
+    
+    def __len__(self):
+        self._compact()
+        return len(self._keys)
+    
+    def _add(self, keys):
+        self._pending.append(keys)
+        self._pending_size += len(keys)
+        self._encoded = None
+        self._period_trends = {}
+        if self._pending_size > max(len(self._keys), CSV_CHUNK_SIZE):
+            self._compact()
+    
+    def _compact(self):
+        if self._pending:
+            # Sort and drop repeats; cheaper than np.unique on large uint64 arrays
+            keys = np.concatenate([self._keys] + self._pending)
+            keys.sort()
+            self._keys = keys[np.append(True, keys[1:] != keys[:-1])] if len(keys) else keys
+            self._pending = []
+            self._pending_size = 0
+    
+    def encoded(self):
+        """
+        Return the triples as integer codes, for usage_trends.
+        
+        Returns:
+        dict: 'days', 'user_codes', 'app_codes' (one entry per triple),
+          'users' and 'apps' (the sorted labels of the codes), and
+          'college_codes' / 'colleges' (the college of each user)
+        """
+        if self._encoded is None:
+            self._compact()
+            days, user_ids, app_ids = self._unpack(self._keys)
             
-            if 'User Email' in df.columns:
-                # Convert to string first to handle NaN values safely
-                df['User Email'] = df['User Email'].astype(str).str.strip()
-                file_users = set(df['User Email'].dropna().unique())
-                users_per_file[f"File {i+1}: {filename}"] = file_users
-                logger.info(f"Processed {filename}: {len(df)} rows, {len(file_users)} unique users")
-            else:
-                logger.warning(f"Processed {filename}: {len(df)} rows, column 'User Email' not found")
+            # Renumber users and apps in sorted order
+            def sorted_codes(labels, ids):
+                labels = np.array(labels, dtype=object)
+                order = np.argsort(labels, kind='mergesort')
+                rank = np.empty(len(order), dtype=np.int32)
+                rank[order] = np.arange(len(order), dtype=np.int32)
+                return rank[ids], labels[order]
             
-            all_dataframes.append(df)
-        except Exception as e:
-            logger.error(f"Error processing file {filename}: {str(e)}", exc_info=True)
-            raise ValueError(f"Error processing file {filename}: {str(e)}")
-        finally:
-            # Clean up the temp file
-            if os.path.exists(file_path):
-                os.remove(file_path)
-    
-    # Check if we have any valid dataframes
-    if not all_dataframes:
-        raise ValueError("No valid data found in uploaded files.")
-    
-    # Identify users that appear in multiple files
-    logger.info("Identifying users appearing in multiple files")
-    all_users_with_files = {}
-    for file_name, users in users_per_file.items():
-        for user in users:
-            if user not in all_users_with_files:
-                all_users_with_files[user] = []
-            all_users_with_files[user].append(file_name)
-    
-    # Log users found in multiple files
-    duplicate_users_across_files = {user: files for user, files in all_users_with_files.items() 
-                                   if len(files) > 1 and user != 'nan'}
-    if duplicate_users_across_files:
-        logger.info(f"Found {len(duplicate_users_across_files)} users appearing in multiple files")
-        for user, files in duplicate_users_across_files.items():
-            logger.debug(f"User {user} appears in: {', '.join(files)}")
+            user_codes, users = sorted_codes(self._users, user_ids)
+            app_codes, apps = sorted_codes(self._apps, app_ids)
+            college_codes, colleges = pd.factorize(classify_emails(pd.Series(users, dtype=object))['College'],
+                                                   sort=True)
+            self._encoded = {
+                'days': days.astype(np.int32),
+                'user_codes': user_codes,
+                'app_codes': app_codes,
+                'users': users,
+                'apps': apps,
+                'college_codes': college_codes.astype(np.int32),
+                'colleges': np.asarray(colleges, dtype=object),
+            }
+        return self._encoded
+    
+    def period_trends(self, period, by):
+        """Return the usage_trends table of all days, counted once per rollup."""
+        if (period, by) not in self._period_trends:
+            encoded = self.encoded()
+            self._period_trends[(period, by)] = count_period_users(
+                encoded, encoded['days'], encoded['user_codes'], encoded['app_codes'], period, by)
+        return self._period_trends[(period, by)]
+    
+    def finalize(self):
+        """Count the users of every period and group, for trend queries."""
+        for period in TREND_PERIODS:
+            for by in TREND_GROUPS:
+                self.period_trends(period, by)
+    
+    def to_arrays(self):
+        """Return the rollup as numpy arrays, for AnalysisState."""
+        encoded = self.encoded()
+        arrays = {name: encoded[name] for name in ['days', 'user_codes', 'app_codes']}
+        arrays['users'], arrays['users_offsets'] = pack_strings(encoded['users'])
+        arrays['apps'], arrays['apps_offsets'] = pack_strings(encoded['apps'])
+        return arrays
+    
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a rollup saved with to_arrays()."""
+        rollup = cls()
+        rollup._intern(unpack_strings(arrays['users'], arrays['users_offsets']), rollup._user_ids, rollup._users)
+        rollup._intern(unpack_strings(arrays['apps'], arrays['apps_offsets']), rollup._app_ids, rollup._apps)
+        rollup._keys = np.unique(rollup._pack(arrays['days'], arrays['user_codes'], arrays['app_codes']))
+        return rollup
+
+def trend_period_starts(days, period):
+    """Return the first day of the `period` holding each day (days since 1970-01-01)."""
+    days = np.asarray(days, dtype=np.int64)
+    if period == 'week':
+        return days - (days + 3) % 7  # 1970-01-01 (day 0) was a Thursday
+    if period == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    return days
+
+def count_period_users(encoded, days, user_codes, app_codes, period, by):
+    """
+    Count distinct users per period and group of some rollup triples.
+    
+    Parameters:
+    encoded (dict): UsageRollup.encoded() of the rollup
+    days, user_codes, app_codes (np.ndarray): The triples to count
+    period (str): One of TREND_PERIODS
+    by (str): One of TREND_GROUPS
+    
+    Returns:
+    pd.DataFrame: The usage_trends table of the triples
+    """
+    period_days, period_codes = np.unique(trend_period_starts(days, period), return_inverse=True)
+    
+    # Group code of each row
+    apps, colleges = encoded['apps'], encoded['colleges']
+    college_codes = encoded['college_codes'][user_codes]
+    if by == 'app':
+        groups, group_count = app_codes, len(apps)
+    elif by == 'college':
+        groups, group_count = college_codes, len(colleges)
+    else:
+        groups, group_count = college_codes * len(apps) + app_codes, len(colleges) * len(apps)
+    
+    # Distinct (period, group, user), then users per (period, group)
+    user_count = max(len(encoded['users']), 1)
+    distinct = np.unique((period_codes.astype(np.int64) * group_count + groups) * user_count + user_codes)
+    counts = np.bincount(distinct // user_count, minlength=len(period_days) * group_count)
+    cells = np.flatnonzero(counts)
+    groups = cells % group_count if group_count else cells
+    
+    trends = pd.DataFrame({'Period': period_days[cells // max(group_count, 1)].astype('datetime64[D]')})
+    if by == 'college':
+        trends['College'] = colleges[groups]
+    elif by == 'app':
+        trends['Adobe App'] = apps[groups]
     else:
-        logger.info("No users found in multiple files.")
+        trends['College'] = colleges[groups // len(apps)] if len(apps) else []
+        trends['Adobe App'] = apps[groups % len(apps)] if len(apps) else []
+    trends['Users'] = counts[cells]
+    return trends
+
+def usage_trends(rollup, start=None, end=None, period='month', by='app'):
+    """
+    Count distinct active users per period from a UsageRollup.
     
-    # Combine all dataframes
-    combined_df = pd.concat(all_dataframes, ignore_index=True, sort=False)
+    A user counts once per period and group, however many days or rows
+    they have in it. Periods wholly inside the date range come from the
+    rollup's precomputed per-period counts (UsageRollup.period_trends);
+    only the days of a period cut by `start` or `end` are counted again.
     
-    # Validation: Make sure we didn't lose any rows
-    total_rows_after = len(combined_df)
-    logger.info(f"Total rows before concatenation: {total_rows_before}")
-    logger.info(f"Total rows after concatenation: {total_rows_after}")
+    Parameters:
+    rollup (UsageRollup): Rollup of the analysed logs
+    start (str): Optional first day, 'YYYY-MM-DD'
+    end (str): Optional last day (inclusive), 'YYYY-MM-DD'
+    period (str): One of TREND_PERIODS
+    by (str): One of TREND_GROUPS: per app, per college, or per college and app
+    
+    Returns:
+    pd.DataFrame: 'Period' (first day of the period), 'College' and/or
+      'Adobe App', and 'Users', sorted by period then group
+    """
+    # Check the query
+    if period not in TREND_PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(TREND_PERIODS)}")
+    if by not in TREND_GROUPS:
+        raise ValueError(f"by must be one of: {', '.join(TREND_GROUPS)}")
+    bounds = []
+    for bound in (start, end):
+        try:
+            bounds.append(int(np.datetime64(bound, 'D').astype(np.int64)) if bound else None)
+        except ValueError:
+            raise ValueError(f"Invalid date: {bound} (expected YYYY-MM-DD)")
+    start_day, end_day = bounds
+    
+    trends = rollup.period_trends(period, by)
+    if start_day is None and end_day is None:
+        return trends.copy()
+    
+    # Whole periods of the range: from the first period starting on or
+    # after start_day up to the period holding end_day + 1
+    first_full, last_full = -np.inf, np.inf
+    if start_day is not None:
+        first_full = int(trend_period_starts([start_day], period)[0])
+        if first_full < start_day:
+            first_full = int(trend_period_starts([first_full + TREND_PERIOD_DAYS[period]], period)[0])
+    if end_day is not None:
+        last_full = int(trend_period_starts([end_day + 1], period)[0])
+    
+    # Days sort first in the rollup keys, so the triples of a day range are a slice
+    encoded = rollup.encoded()
+    days = encoded['days']
+    
+    def count_days(first, last):
+        """Count the triples of days first..last (inclusive) from scratch."""
+        lo = 0 if first is None else np.searchsorted(days, first, side='left')
+        hi = len(days) if last is None else np.searchsorted(days, last, side='right')
+        return count_period_users(encoded, days[lo:hi].astype(np.int64), encoded['user_codes'][lo:hi],
+                                  encoded['app_codes'][lo:hi], period, by)
+    
+    if first_full >= last_full:
+        return count_days(start_day, end_day)
+    period_days = trends['Period'].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    parts = [trends[(period_days >= first_full) & (period_days < last_full)]]
+    if start_day is not None and start_day < first_full:
+        parts.insert(0, count_days(start_day, first_full - 1))
+    if end_day is not None and last_full <= end_day:
+        parts.append(count_days(last_full, end_day))
+    return pd.concat(parts, ignore_index=True)
+
+def timed_chunks(chunks, timer, stage):
+    """Pass (columns, chunk) pairs through, timing the reads as `stage`."""
+    chunks = iter(chunks)
+    while True:
+        with timer.stage(stage) as measured:
+            try:
+                columns, chunk = next(chunks)
+            except StopIteration:
+                return
+            measured['rows'] = len(chunk)
+        yield columns, chunk
+
+def import_pyarrow():
+    """
+    Return (pyarrow, pyarrow.parquet), imported on first use so the app
+    starts without loading them, or (None, None) if pyarrow is not
+    installed; the combined log then falls back to CSV.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None, None
+    return pyarrow, pyarrow.parquet
+
+def combined_log_schema():
+    """Arrow schema of the combined log; repetitive columns are dictionary-encoded."""
+    pa, _ = import_pyarrow()
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('User Email', category),
+        ('Item Path', pa.string()),
+        ('Timestamp', pa.timestamp('ns')),
+        ('Adobe App', category),
+        ('College', category),
+    ])
+
+def combined_log_table(chunk):
+    """
+    Convert a prepared chunk into an Arrow table for the combined log.
     
-    if total_rows_before != total_rows_after:
-        logger.warning("WARNING: Row count mismatch after concatenation!")
+    Categorical columns are dictionary-encoded from their codes, and the
+    college is worked out once per distinct email.
+    """
+    pa, _ = import_pyarrow()
+    emails = pd.Categorical(chunk['User Email'])
+    colleges = classify_emails(pd.Series(emails.categories, dtype=object))['College'].cat.codes.to_numpy()
+    colleges = pd.Categorical.from_codes(np.append(colleges, EMAIL_COLLEGES.index('Non-UST'))[emails.codes],
+                                         EMAIL_COLLEGES)
+    timestamps = chunk['Timestamp']
     
-    # Verify that the required columns exist
-    required_columns = ['User Email', 'Item Path']
-    missing_columns = [col for col in required_columns if col not in combined_df.columns]
+    def strings(values):
+        # Missing values (NaN) become nulls
+        return pa.array(np.asarray(values, dtype=object), type=pa.string(), from_pandas=True)
     
-    if missing_columns:
-        raise ValueError(f"Required columns missing in input files: {', '.join(missing_columns)}. "
-                       f"Analysis requires columns: {', '.join(required_columns)}")
+    def category(values):
+        values = pd.Categorical(values)
+        return pa.DictionaryArray.from_arrays(pa.array(values.codes.astype(np.int32)), strings(values.categories),
+                                              from_pandas=True)
     
-    # Clean data and ensure types are correct
-    combined_df['User Email'] = combined_df['User Email'].astype(str).str.strip()
-    combined_df['Item Path'] = combined_df['Item Path'].astype(str)
+    return pa.Table.from_arrays([
+        category(emails),
+        strings(chunk['Item Path']),
+        pa.array(timestamps.to_numpy(), type=pa.timestamp('ns'), from_pandas=True),
+        category(chunk['Adobe App']),
+        category(colleges),
+    ], schema=combined_log_schema())
+
+class FileSummary:
+    """
+    Compact result of ingesting one uploaded file.
     
-    # Count duplicates - rows where the same user accessed the same item path
-    total_rows = len(combined_df)
-    duplicate_count = total_rows - len(combined_df.drop_duplicates(subset=['User Email', 'Item Path']))
-    logger.info(f"Total rows: {total_rows}, Duplicate rows: {duplicate_count}")
+    Holds the row count, header, distinct users, per-user first usage, a
+    count of distinct (User Email, Item Path) keys and the UsageRollup -
+    everything
+    process_saved_files needs to merge files, without keeping the rows
+    themselves - plus the CSV encoding and skipped line numbers for the
+    preview. The labelled rows go to `part_path`.parquet (and .csv when
+    needed) for the combined log.
+    """
     
-    # Process for Adobe analysis
-    combined_df['Adobe App'] = combined_df['Item Path'].apply(extract_adobe_app)
+    def __init__(self, filename, source, part_path=None):
+        self.filename = filename
+        self.source = source
+        self.part_path = part_path
+        self.rows = 0
+        self.columns = set()
+        self.users = set()
+        self.first_usage = FirstUsageAggregator()
+        self.keys = DistinctKeyCounter()
+        self.rollup = UsageRollup()
+        self.cache_entries = []
+        self.rule_hits = RuleHitCounter()
+        self.timer = None
+        self.encoding = None
+        self.skipped_lines = []
+        self._log_writer = None
+        self.discard_part()
     
-    # Add row metrics to the dataframe as attributes
-    combined_df.total_rows = total_rows
-    combined_df.duplicate_rows = duplicate_count
+    def add(self, columns, chunk):
+        """Fold one prepared chunk into the summary."""
+        self.columns = self.columns | columns
+        self.rows += len(chunk)
+        self.users.update(chunk['User Email'].unique())
+        self.first_usage.add(chunk, source=self.source)
+        
+        self.keys.add(chunk)
+        self.rollup.add(chunk)
+        
+        # Keep the labelled rows on disk for the combined log
+        if self.part_path:
+            _, pq = import_pyarrow()
+            if pq is not None:
+                if self._log_writer is None:
+                    self._log_writer = pq.ParquetWriter(self.part_path + '.parquet', combined_log_schema())
+                self._log_writer.write_table(combined_log_table(chunk))
+            if EXPORT_COMBINED_CSV or pq is None:
+                csv_path = self.part_path + '.csv'
+                chunk.to_csv(csv_path, mode='a', header=not os.path.exists(csv_path), index=False)
     
-    # Save combined file for reference
-    combined_csv = os.path.join(UPLOAD_FOLDER, 'combined_adobe_logs.csv')
-    combined_df.to_csv(combined_csv, index=False)
+    def close(self):
+        """Finish the part files; the summary can then be pickled."""
+        if self._log_writer is not None:
+            self._log_writer.close()
+            self._log_writer = None
     
-    return combined_df
+    def discard_part(self):
+        """Remove part files left by an earlier, failed read of the file."""
+        self.close()
+        if self.part_path:
+            for extension in ('.parquet', '.csv'):
+                if os.path.exists(self.part_path + extension):
+                    os.remove(self.part_path + extension)
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    if request.method == 'POST':
-        # Check if files are in request
-        if 'files' not in request.files:
-            return render_template('index.html', error='No files selected')
+def init_ingest_worker():
+    """Start a worker process of process_saved_files: it sends back only the cache entries it adds itself."""
+    app_detection_cache.drain_added()
+
+def ingest_file(file_path, filename, source, chunksize=CSV_CHUNK_SIZE, part_path=None, rules=None):
+    """
+    Parse, label and summarise one uploaded file.
+    
+    Runs in a worker process when process_saved_files is parallel, so it only
+    takes and returns picklable values. CSV files have their encoding
+    detected up front and are parsed once; only a file with malformed lines
+    is read a second time, skipping those lines. Apps are labelled with
+    `rules` (AdobeAppRules), the current rules by default.
+    
+    Returns a FileSummary; its `timer` holds the stage timings of the file.
+    """
+    timer = StageTimer()
+    encoding = None
+    if filename.endswith('.csv'):
+        with timer.stage('detect encoding'):
+            encoding = detect_csv_encoding(file_path)
+    
+    def read(skip_bad_lines):
+        summary = FileSummary(filename, source, part_path)
+        summary.encoding = encoding
+        try:
+            if encoding is not None:
+                chunks = read_csv_chunks(file_path, encoding, chunksize,
+                                         summary.skipped_lines if skip_bad_lines else None)
+                parse_stage = f"parse csv ({encoding}{', skipping bad lines' if skip_bad_lines else ''})"
+            else:  # .xlsx
+                chunks = read_excel_chunks(file_path, chunksize)
+                parse_stage = 'parse xlsx'
+            
+            for columns, chunk in timed_chunks(chunks, timer, parse_stage):
+                chunk = prepare_chunk(chunk, timer, rules, summary.rule_hits)
+                with timer.stage('summarize', rows=len(chunk)):
+                    summary.add(columns, chunk)
+        except Exception:
+            summary.discard_part()
+            raise
+        return summary
+    
+    try:
+        summary = read(skip_bad_lines=False)
+    except pd.errors.ParserError as e:
+        logger.warning(f"{filename} has malformed lines, reading it again without them: {str(e).strip()}")
+        summary = read(skip_bad_lines=True)
+    
+    summary.close()
+    summary.cache_entries = app_detection_cache.drain_added()
+    summary.timer = timer
+    if summary.skipped_lines:
+        logger.warning(f"Skipped {len(summary.skipped_lines)} malformed lines in {filename}: "
+                       f"{', '.join(map(str, summary.skipped_lines[:10]))}"
+                       f"{' ...' if len(summary.skipped_lines) > 10 else ''}")
+    return summary
+
+class UploadSpool:
+    """
+    Stream for one uploaded file while the request body is parsed.
+    
+    The file is written straight to UPLOAD_FOLDER and hashed as it arrives,
+    so saving it is a rename (claim) rather than a copy and the run id needs
+    no second read. Unclaimed files are deleted when the request is closed,
+    including those of a body that failed to parse. Other file methods
+    (read, seek, ...) go to the open file.
+    """
+    
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(dir=UPLOAD_FOLDER, suffix='.upload')
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.claimed = False
+    
+    def write(self, data):
+        self.digest.update(data)
+        return self.file.write(data)
+    
+    def claim(self, file_path):
+        """Move the received file to file_path and return its SHA-256 hex digest."""
+        self.file.close()
+        os.replace(self.path, file_path)
+        self.claimed = True
+        return self.digest.hexdigest()
+    
+    def close(self):
+        self.file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+class UploadRequest(Request):
+    """Request whose uploaded files are received into UploadSpool streams."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_spools = []
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Every spool is recorded here, since a truncated or aborted body
+        # leaves some out of request.files
+        spool = UploadSpool()
+        self.upload_spools.append(spool)
+        return spool
+    
+    def close(self):
+        """Close the request's files and delete every unclaimed upload."""
+        try:
+            super().close()
+        finally:
+            for spool in self.upload_spools:
+                spool.close()
+
+app.request_class = UploadRequest
+
+def save_uploads(files, folder, digests=None):
+    """
+    Save uploaded files into folder.
+    
+    Returns a list of (index, filename, file_path); each upload gets its own
+    path so two uploads with the same name cannot overwrite each other.
+    Files received into an UploadSpool are moved rather than copied, and
+    their SHA-256 digests are added to `digests` (file_path -> hex digest)
+    when a dict is given.
+    """
+    saved_files = []
+    for i, file in enumerate(files):
+        filename = secure_filename(file.filename)
+        file_path = os.path.join(folder, f'{i}_{filename}')
+        if isinstance(file.stream, UploadSpool):
+            digest = file.stream.claim(file_path)
+            if digests is not None:
+                digests[file_path] = digest
+        else:
+            file.save(file_path)
+        saved_files.append((i, filename, file_path))
+    return saved_files
+
+class AnalysisState:
+    """
+    Everything process_saved_files merges from the files of an analysis.
+    
+    Holds the per-user first usage, the users of each file, the distinct
+    (User Email, Item Path) key hashes, the UsageRollup, and the row,
+    column and file details. A run keeps its state (STATE_NAME in the run folder), so new
+    logs can be added to an analysis by merging only the new files into a
+    copy of it.
+    
+    The state is saved as an .npz of plain numpy arrays, uncompressed since
+    the key hashes take most of the space and don't compress. Strings are
+    stored with pack_strings, so loading needs no pickle.
+    """
+    STATE_NAME = 'analysis_state.npz'
+    FORMAT_VERSION = 2
+    
+    def __init__(self, rules_version=None):
+        self.first_usage = FirstUsageAggregator()
+        self.users_per_file = OrderedDict()
+        self.distinct_keys = DistinctKeyCounter()
+        self.rollup = UsageRollup()
+        self.seen_columns = set()
+        self.total_rows = 0
+        self.file_details = []
+        self.rules_version = rules_version or get_rules_version()
+    
+    @property
+    def file_count(self):
+        """Number of files merged so far; new files continue the source numbering."""
+        return len(self.file_details)
+    
+    def add(self, summary):
+        """Merge one file's FileSummary."""
+        self.total_rows += summary.rows
+        self.seen_columns.update(summary.columns)
+        self.first_usage.merge(summary.first_usage)
+        self.distinct_keys.merge(summary.keys)
+        self.rollup.merge(summary.rollup)
+        self.file_details.append({
+            'filename': summary.filename,
+            'rows': summary.rows,
+            'encoding': summary.encoding or 'xlsx',
+            'skipped_lines': len(summary.skipped_lines),
+        })
+        if 'User Email' in summary.columns:
+            self.users_per_file[f"File {summary.source+1}: {summary.filename}"] = summary.users
+    
+    def save(self, path):
+        """Write the state to `path`, replacing any previous file atomically."""
+        meta = {
+            'format_version': self.FORMAT_VERSION,
+            'rules_version': self.rules_version,
+            'total_rows': self.total_rows,
+            'seen_columns': sorted(self.seen_columns),
+            'file_details': self.file_details,
+            'file_names': list(self.users_per_file),
+            'file_user_counts': [len(users) for users in self.users_per_file.values()],
+        }
+        arrays = {'meta': np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8)}
+        arrays['users'], arrays['users_offsets'] = pack_strings(
+            [user for users in self.users_per_file.values() for user in users])
+        for name, array in self.first_usage.to_arrays().items():
+            arrays['first_usage.' + name] = array
+        for name, array in self.distinct_keys.to_arrays().items():
+            arrays['distinct_keys.' + name] = array
+        for name, array in self.rollup.to_arrays().items():
+            arrays['rollup.' + name] = array
         
-        files = request.files.getlist('files')
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Read a state written by save().
         
-        # Check if files were selected
-        if not files or files[0].filename == '':
-            return render_template('index.html', error='No files selected')
+        Raises ValueError if the state can't be extended here: it was built
+        with other detection rules or another DUPLICATE_COUNT_MODE.
+        """
+        with np.load(path, allow_pickle=False) as stored:
+            arrays = {name: stored[name] for name in stored.files}
+        meta = json.loads(arrays['meta'].tobytes().decode('utf-8'))
+        if meta['format_version'] != cls.FORMAT_VERSION:
+            raise ValueError("The earlier analysis was saved by an older version of this app. "
+                             "Please upload all of its files again.")
+        if meta['rules_version'] != get_rules_version():
+            raise ValueError("The earlier analysis was made with different app detection rules. "
+                             "Please upload all of its files again.")
         
-        # Filter only allowed files
-        valid_files = [f for f in files if f and allowed_file(f.filename)]
+        state = cls()
+        state.total_rows = meta['total_rows']
+        state.seen_columns = set(meta['seen_columns'])
+        state.file_details = meta['file_details']
+        users = unpack_strings(arrays['users'], arrays['users_offsets'])
+        ends = np.cumsum(meta['file_user_counts'], dtype=np.int64)
+        for name, start, end in zip(meta['file_names'], ends - meta['file_user_counts'], ends):
+            state.users_per_file[name] = set(users[start:end])
         
-        if not valid_files:
-            return render_template('index.html', error='No valid CSV or XLSX files selected')
+        def section(prefix):
+            return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+        state.first_usage = FirstUsageAggregator.from_arrays(section('first_usage.'))
+        state.distinct_keys = DistinctKeyCounter.from_arrays(section('distinct_keys.'))
+        state.rollup = UsageRollup.from_arrays(section('rollup.'))
+        if state.distinct_keys.approximate != (DUPLICATE_COUNT_MODE == 'approximate'):
+            raise ValueError("The earlier analysis counted duplicates in a different mode. "
+                             "Please upload all of its files again.")
+        return state
+
+def process_saved_files(saved_files, chunksize=CSV_CHUNK_SIZE, workers=PROCESS_WORKERS, progress=None, timer=None,
+                        log_folder=None, state=None, rules=None):
+    """
+    Process uploaded files and return per-user first app usage.
+    Tracks total and duplicate rows across all files.
+    Also identifies users that appear in multiple files.
+    
+    Each file is streamed in chunks of `chunksize` rows and reduced to a
+    FileSummary; with more than one worker, files are ingested in parallel
+    worker processes and their summaries merged here.
+    
+    Parameters:
+      saved_files (list): (index, filename, file_path) tuples from save_uploads.
+      progress (callable): Optional progress(stage, done, total) callback.
+        Apps are labelled chunk by chunk while a file is read, so the
+        'ingest' and 'classify' stages advance together, one file at a time.
+      timer (StageTimer): Optional timer; gets the stages of every file
+        and of the merge.
+      log_folder (str): Folder to write the combined log to (see
+        write_combined_log); no log is kept when None. It holds the rows of
+        saved_files only.
+      state (AnalysisState): Optional state of earlier files; the files
+        are merged into it and numbered after them. The result then covers
+        all files.
+      rules (AdobeAppRules): Detection rules for every file of the run;
+        the current rules by default. They must be those of `state`.
+    
+    Returns a DataFrame with one row per user ('User Email', 'Timestamp',
+    'Adobe App') and `total_rows` / `duplicate_rows` attributes.
+    """
+    if progress is None:
+        progress = lambda stage, done, total: None
+    timer = timer or StageTimer()
+    rules = rules or get_adobe_app_rules()
+    state = state if state is not None else AnalysisState(rules.version)
+    if state.rules_version != rules.version:
+        raise ValueError("The earlier analysis was made with different app detection rules. "
+                         "Please upload all of its files again.")
+    first_source = state.file_count
+    
+    parts_folder = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
+    
+    try:
+        def file_done(count):
+            progress('ingest', count, len(saved_files))
+            progress('classify', count, len(saved_files))
         
+        file_done(0)
+        summaries = []
+        workers = max(1, min(workers, len(saved_files)))
+        if workers == 1:
+            for i, filename, file_path in saved_files:
+                try:
+                    summaries.append(ingest_file(file_path, filename, first_source + i, chunksize,
+                                                 os.path.join(parts_folder, str(i)), rules))
+                    file_done(len(summaries))
+                except Exception as e:
+                    logger.error(f"Error processing file {filename}: {str(e)}", exc_info=True)
+                    raise ValueError(f"Error processing file {filename}: {str(e)}")
+        else:
+            logger.info(f"Processing {len(saved_files)} files with {workers} worker processes")
+            # Spawned rather than forked: analyses run on job threads, and a fork would copy
+            # locks (such as the detection cache's) that another thread holds at that moment
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_ingest_worker) as executor:
+                futures = [
+                    (filename, executor.submit(ingest_file, file_path, filename, first_source + i, chunksize,
+                                               os.path.join(parts_folder, str(i)), rules))
+                    for i, filename, file_path in saved_files
+                ]
+                for filename, future in futures:
+                    try:
+                        summaries.append(future.result())
+                        file_done(len(summaries))
+                    except Exception as e:
+                        logger.error(f"Error processing file {filename}: {str(e)}", exc_info=True)
+                        raise ValueError(f"Error processing file {filename}: {str(e)}")
+        
+        # Merge the per-file summaries in upload order
+        progress('aggregate', 0, 1)
+        with timer.stage('merge', rows=sum(summary.rows for summary in summaries)):
+            for summary in summaries:
+                timer.merge(summary.timer)
+                state.add(summary)
+                rule_hits.merge(summary.rule_hits)
+                if summary.cache_entries:
+                    paths, rule_ids = zip(*summary.cache_entries)
+                    app_detection_cache.store(paths, rule_ids, rules.version, record=False)
+                
+                if 'User Email' in summary.columns:
+                    logger.info(f"Processed {summary.filename}: {summary.rows} rows, {len(summary.users)} unique users")
+                else:
+                    logger.warning(f"Processed {summary.filename}: {summary.rows} rows, column 'User Email' not found")
+            
+            app_detection_cache.save()
+        first_usage = state.first_usage
+        users_per_file = state.users_per_file
+        seen_columns = state.seen_columns
+        total_rows = state.total_rows
+        distinct_keys = state.distinct_keys
+        file_details = list(state.file_details)
+        
+        # Check if we have any valid data
+        if not summaries:
+            raise ValueError("No valid data found in uploaded files.")
+        
+        # Identify users that appear in multiple files
+        logger.info("Identifying users appearing in multiple files")
+        all_users_with_files = {}
+        for file_name, users in users_per_file.items():
+            for user in users:
+                if user not in all_users_with_files:
+                    all_users_with_files[user] = []
+                all_users_with_files[user].append(file_name)
+        
+        # Log users found in multiple files
+        duplicate_users_across_files = {user: files for user, files in all_users_with_files.items() 
+                                       if len(files) > 1 and user != 'nan'}
+        if duplicate_users_across_files:
+            logger.info(f"Found {len(duplicate_users_across_files)} users appearing in multiple files")
+            for user, files in duplicate_users_across_files.items():
+                logger.debug(f"User {user} appears in: {', '.join(files)}")
+        else:
+            logger.info("No users found in multiple files.")
+        
+        # Verify that the required columns exist
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in seen_columns]
+        
+        if missing_columns:
+            raise ValueError(f"Required columns missing in input files: {', '.join(missing_columns)}. "
+                           f"Analysis requires columns: {', '.join(REQUIRED_COLUMNS)}")
+        
+        # Count duplicates - rows where the same user accessed the same item path
+        with timer.stage('dedup count', rows=total_rows):
+            duplicate_count = total_rows - distinct_keys.count()
+        if distinct_keys.approximate:
+            duplicate_count = max(duplicate_count, 0)
+            logger.info(f"Total rows: {total_rows}, Duplicate rows: ~{duplicate_count} (approximate)")
+        else:
+            logger.info(f"Total rows: {total_rows}, Duplicate rows: {duplicate_count}")
+        
+        # Save combined file for reference
+        if log_folder is not None:
+            with timer.stage('combined log', rows=total_rows):
+                write_combined_log([os.path.join(parts_folder, str(i)) for i, _, _ in saved_files], log_folder)
+        
+        # Add row metrics to the per-user table as attributes
+        with timer.stage('aggregate', rows=total_rows):
+            result_df = first_usage.result()
+        result_df.total_rows = total_rows
+        result_df.duplicate_rows = duplicate_count
+        result_df.duplicate_rows_approximate = distinct_keys.approximate
+        result_df.usage_rollup = state.rollup
+        result_df.attrs['adobe_apps'] = rules.apps
+        # A list can't be set as a plain attribute, so the per-file details go in attrs
+        result_df.attrs['files'] = file_details
+        progress('aggregate', 1, 1)
+        
+        return result_df
+    finally:
+        shutil.rmtree(parts_folder, ignore_errors=True)
+
+def write_combined_log(part_paths, folder):
+    """
+    Join the per-file parts into the combined log in `folder`.
+    
+    The Parquet log (COMBINED_LOG_NAME) is copied row group by row group, so
+    no part is loaded whole. The CSV export (COMBINED_CSV_NAME) is written
+    when EXPORT_COMBINED_CSV is set, or instead of Parquet if pyarrow is not
+    installed.
+    """
+    _, pq = import_pyarrow()
+    if pq is not None:
+        with pq.ParquetWriter(os.path.join(folder, COMBINED_LOG_NAME), combined_log_schema(),
+                              compression='zstd') as writer:
+            for part_path in part_paths:
+                if not os.path.exists(part_path + '.parquet'):
+                    continue
+                part = pq.ParquetFile(part_path + '.parquet')
+                for row_group in range(part.num_row_groups):
+                    writer.write_table(part.read_row_group(row_group))
+    else:
+        logger.warning("pyarrow is not installed, writing the combined log as CSV only")
+    
+    if EXPORT_COMBINED_CSV or pq is None:
+        header_written = False
+        with open(os.path.join(folder, COMBINED_CSV_NAME), 'w', encoding='utf-8', newline='') as output:
+            for part_path in part_paths:
+                if not os.path.exists(part_path + '.csv'):
+                    continue
+                with open(part_path + '.csv', 'r', encoding='utf-8', newline='') as part:
+                    header = part.readline()
+                    if not header_written:
+                        output.write(header)
+                        header_written = True
+                    shutil.copyfileobj(part, output)
+
+def load_combined_log(path):
+    """
+    Read a combined log (a run's COMBINED_LOG_NAME) back for re-analysis.
+    
+    Returns the labelled rows with 'User Email', 'Adobe App' and 'College'
+    as categoricals; the result can go straight into
+    generate_college_usage_stats.
+    """
+    if path.endswith('.csv'):
+        return pd.read_csv(path, dtype={'User Email': str, 'Item Path': str})
+    return pd.read_parquet(path)
+
+def get_uploaded_files():
+    """
+    Return (valid_files, error) for the files in the current request.
+    error is a message for the user, or None if there is something to process.
+    """
+    # Check if files are in request
+    if 'files' not in request.files:
+        return [], 'No files selected'
+    
+    files = request.files.getlist('files')
+    
+    # Check if files were selected
+    if not files or files[0].filename == '':
+        return [], 'No files selected'
+    
+    # Filter only allowed files
+    valid_files = [f for f in files if f and allowed_file(f.filename)]
+    
+    if not valid_files:
+        return [], 'No valid CSV or XLSX files selected'
+    
+    return valid_files, None
+
+def describe_error(e):
+    """Turn an analysis exception into a message for the user."""
+    if isinstance(e, ValueError):
+        # Handle specific validation errors with clear messages
+        logger.error(f"ValueError: {str(e)}", exc_info=True)
+        return str(e)
+    
+    logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+    
+    # Create a more user-friendly error message
+    error_msg = str(e)
+    if "User Email" in error_msg:
+        error_msg = "Analysis requires files with 'User Email' and 'Item Path' columns. Your files don't match this format."
+    
+    return f"Error processing files: {error_msg}"
+
+@app.route('/', methods=['GET', 'POST'])
+def index():
+    if request.method == 'POST':
+        valid_files, error = get_uploaded_files()
+        if error:
+            return render_template('index.html', error=error)
+        
+        upload_folder = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
         try:
             # Process files - directly go to college stats generation
-            combined_df = process_files(valid_files)
-            success, preview_data = generate_college_usage_stats(combined_df, COLLEGE_STATS_FOLDER)
+            timer = StageTimer()
+            digests = {}
+            with timer.stage('save'):
+                saved_files = save_uploads(valid_files, upload_folder, digests)
+            run_id, preview_data = analyze_run(saved_files, timer=timer, digests=digests,
+                                               base_run=request.form.get('base_run') or None)
             
-            if success:
+            if preview_data is not None:
                 return render_template('index.html', success=True, file_count=len(valid_files), 
                                       preview_data=preview_data)
             else:
                 return render_template('index.html', error="Failed to generate college statistics.")
                 
-        except ValueError as e:
-            # Handle specific validation errors with clear messages
-            logger.error(f"ValueError: {str(e)}", exc_info=True)
-            return render_template('index.html', error=str(e))
         except Exception as e:
-            logger.error(f"Unexpected error: {str(e)}", exc_info=True)
-            
-            # Create a more user-friendly error message
-            error_msg = str(e)
-            if "User Email" in error_msg:
-                error_msg = "Analysis requires files with 'User Email' and 'Item Path' columns. Your files don't match this format."
-                
-            return render_template('index.html', error=f"Error processing files: {error_msg}")
+            return render_template('index.html', error=describe_error(e))
+        finally:
+            # Clean up the temp files
+            shutil.rmtree(upload_folder, ignore_errors=True)
     
     return render_template('index.html')
 
-@app.route('/download/<filename>')
-def download_file(filename):
+# Background analysis jobs
+class AnalysisJob:
+    """
+    State of one background analysis, polled by the front end.
+    
+    The job runs in the server process that received it, but its status is
+    also written to JOBS_FOLDER on every change, so a poll answered by
+    another process of a multi-process server finds it (see load()). The
+    result page then comes from the stored run.
+    """
+    JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    
+    def __init__(self, file_count):
+        self.id = uuid.uuid4().hex
+        self.file_count = file_count
+        self.status = 'queued'
+        self.stages = OrderedDict((stage, {'status': 'pending', 'done': 0, 'total': 0}) for stage in JOB_STAGES)
+        self.error = None
+        self.preview_data = None
+        self.run_id = None
+        self.created_at = time.time()
+        self.finished_at = None
+    
+    def update_stage(self, stage, done, total):
+        """Record progress for a stage; earlier stages are marked complete."""
+        self.status = 'running'
+        for name, info in self.stages.items():
+            if name == stage:
+                info.update(status='done' if total and done >= total else 'running', done=done, total=total)
+                break
+            info['status'] = 'done'
+        self.save()
+    
+    def finish(self, preview_data):
+        for info in self.stages.values():
+            info.update(status='done', done=info['total'])
+        self.preview_data = preview_data
+        self.run_id = preview_data.get('run_id')
+        self.status = 'done'
+        self.finished_at = time.time()
+        self.save()
+    
+    def fail(self, error):
+        self.error = error
+        self.status = 'failed'
+        self.finished_at = time.time()
+        self.save()
+    
+    @staticmethod
+    def path(job_id):
+        return os.path.join(JOBS_FOLDER, f"{job_id}.json")
+    
+    def save(self):
+        """Write the job's status file, replacing the previous one atomically."""
+        state = {
+            'file_count': self.file_count,
+            'status': self.status,
+            'stages': self.stages,
+            'error': self.error,
+            'run_id': self.run_id,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+        temp_path = f"{self.path(self.id)}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+            os.replace(temp_path, self.path(self.id))
+        except OSError as e:
+            logger.warning(f"Could not write the status of job {self.id}: {str(e)}")
+    
+    @classmethod
+    def load(cls, job_id):
+        """Return a job from its status file (without preview_data), or None."""
+        if not cls.JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(cls.path(job_id), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        job = cls(state['file_count'])
+        job.id = job_id
+        job.stages = OrderedDict((name, state['stages'][name]) for name in JOB_STAGES)
+        for name in ['status', 'error', 'run_id', 'created_at', 'finished_at']:
+            setattr(job, name, state[name])
+        return job
+    
+    def discard(self):
+        """Remove the job's status file."""
+        try:
+            os.remove(self.path(self.id))
+        except OSError:
+            pass
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'file_count': self.file_count,
+            'stages': [dict(info, name=name) for name, info in self.stages.items()],
+            'error': self.error,
+            'status_url': url_for('job_status', job_id=self.id),
+            'result_url': url_for('job_result', job_id=self.id),
+        }
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='analysis-job')
+jobs = OrderedDict()
+jobs_lock = threading.Lock()
+
+class RunStore:
+    """
+    Results of analysis runs, one folder per run under `folder`.
+    
+    A run id is a hash of the uploaded files (names and contents, in upload
+    order), the detection rules version, DUPLICATE_COUNT_MODE and the run
+    the files were added to (if any), so the same upload maps to the same
+    folder and reuses its reports. A run is
+    complete once its PREVIEW_NAME file (the preview_data of the result
+    page) is written; its modification time records when the run was last
+    used, for evict().
+    
+    A run's lock is held while it is computed or read. Besides a thread
+    lock, it is an flock on a file in LOCKS_NAME, so the processes of a
+    multi-process server exclude each other too (where fcntl exists).
+    
+    Parameters:
+    folder (str): Folder holding the run folders
+    max_bytes (int): Total size kept after eviction
+    max_age (float): Seconds a run is kept after it was last used
+    """
+    PREVIEW_NAME = 'preview.json'
+    LOCKS_NAME = '.locks'
+    RUN_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+    
+    def __init__(self, folder, max_bytes, max_age):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.locks_folder = os.path.join(folder, self.LOCKS_NAME)
+        os.makedirs(self.locks_folder, exist_ok=True)
+    
+    def run_id(self, saved_files, digests=None, base_run=None, rules_version=None):
+        """
+        Return the run id of (index, filename, file_path) tuples from
+        save_uploads, added to run `base_run` if given. Files missing from
+        `digests` (file_path -> SHA-256 hex digest, as filled in by
+        save_uploads) are hashed here. The id covers the detection rules,
+        `rules_version` or the current ones.
+        """
+        digest = hashlib.sha256(f"{rules_version or get_rules_version()}:{DUPLICATE_COUNT_MODE}:{base_run or ''}".encode())
+        for _, filename, file_path in saved_files:
+            file_digest = (digests or {}).get(file_path)
+            if file_digest is None:
+                file_hash = hashlib.sha256()
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(ENCODING_BLOCK_SIZE), b''):
+                        file_hash.update(block)
+                file_digest = file_hash.hexdigest()
+            digest.update(f"\0{filename}\0{file_digest}".encode())
+        return digest.hexdigest()[:32]
+    
+    def path(self, run_id):
+        """Return the folder of a run; run_id must be a valid id."""
+        if not self.RUN_ID_PATTERN.match(run_id):
+            raise ValueError(f"Invalid run id: {run_id}")
+        return os.path.join(self.folder, run_id)
+    
+    def _lock_of(self, run_id):
+        with self._locks_guard:
+            return self._locks.setdefault(run_id, threading.Lock())
+    
+    def _lock_file(self, run_id, blocking=True):
+        """
+        Take the flock of a run's lock file.
+        
+        Returns the open file descriptor (closing it releases the lock),
+        or None if not `blocking` and another process holds the lock.
+        """
+        path = os.path.join(self.locks_folder, run_id)
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return None
+            
+            # evict() may have removed the file while we waited for it
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+    
+    def _acquire(self, run_id, blocking=True):
+        """
+        Take a run's thread lock and lock file.
+        
+        Returns the lock file's descriptor (None without fcntl, or for an
+        invalid id, which never names a file), or False if not `blocking`
+        and the run is locked.
+        """
+        lock = self._lock_of(run_id)
+        if not lock.acquire(blocking):
+            return False
+        if fcntl is None or not self.RUN_ID_PATTERN.match(run_id):
+            return None
+        try:
+            fd = self._lock_file(run_id, blocking)
+        except BaseException:
+            lock.release()
+            raise
+        if fd is None:
+            lock.release()
+            return False
+        return fd
+    
+    def _release(self, run_id, fd, remove=False):
+        """Release a lock taken with _acquire, removing the lock file with `remove`."""
+        if fd is not None:
+            if remove:
+                try:
+                    os.remove(os.path.join(self.locks_folder, run_id))
+                except OSError:
+                    pass
+            os.close(fd)
+        self._lock_of(run_id).release()
+    
+    @contextmanager
+    def lock(self, run_id):
+        """Hold a run's lock while computing or reading it; evict() skips locked runs."""
+        fd = self._acquire(run_id)
+        try:
+            yield
+        finally:
+            self._release(run_id, fd)
+    
+    def load(self, run_id):
+        """Return the preview_data of a complete run (marking it used), or None."""
+        if not self.RUN_ID_PATTERN.match(run_id):
+            return None
+        preview_path = os.path.join(self.path(run_id), self.PREVIEW_NAME)
+        try:
+            with open(preview_path, 'r', encoding='utf-8') as f:
+                preview_data = json.load(f)
+            os.utime(preview_path)
+        except (OSError, ValueError):
+            return None
+        return preview_data
+    
+    def load_state(self, run_id):
+        """Return the AnalysisState of a complete run; ValueError if it is no longer stored."""
+        if self.load(run_id) is None:
+            raise ValueError("The analysis to add these files to is no longer available. "
+                             "Please upload all of its files again.")
+        return AnalysisState.load(os.path.join(self.path(run_id), AnalysisState.STATE_NAME))
+    
+    def create(self, run_id):
+        """Return an empty folder for a run, discarding an incomplete earlier attempt."""
+        path = self.path(run_id)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+    
+    def save(self, run_id, preview_data):
+        """Store the preview_data of a run, which completes it."""
+        preview_path = os.path.join(self.path(run_id), self.PREVIEW_NAME)
+        with open(preview_path + '.tmp', 'w', encoding='utf-8') as f:
+            # numpy counts become plain numbers
+            json.dump(preview_data, f, default=lambda value: value.item())
+        os.replace(preview_path + '.tmp', preview_path)
+    
+    def evict(self, keep=None):
+        """
+        Remove runs not used for max_age seconds, then the least recently
+        used runs until the store fits in max_bytes. Runs that are locked,
+        and `keep`, are never removed.
+        """
+        runs = []
+        total_bytes = 0
+        for run_id in os.listdir(self.folder):
+            path = os.path.join(self.folder, run_id)
+            if not self.RUN_ID_PATTERN.match(run_id) or not os.path.isdir(path):
+                continue
+            preview_path = os.path.join(path, self.PREVIEW_NAME)
+            try:
+                last_used = os.path.getmtime(preview_path if os.path.exists(preview_path) else path)
+                size = sum(os.path.getsize(os.path.join(root, file))
+                           for root, _, files in os.walk(path) for file in files)
+            except OSError:
+                continue
+            total_bytes += size
+            if run_id != keep:
+                runs.append((last_used, size, run_id))
+        
+        now = time.time()
+        for last_used, size, run_id in sorted(runs):
+            if now - last_used <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            fd = self._acquire(run_id, blocking=False)
+            if fd is False:
+                continue
+            try:
+                shutil.rmtree(self.path(run_id), ignore_errors=True)
+            finally:
+                self._release(run_id, fd, remove=True)
+            with self._locks_guard:
+                self._locks.pop(run_id, None)
+            total_bytes -= size
+            logger.info(f"Evicted run {run_id} ({size / (1024 * 1024):.1f} MB, "
+                        f"last used {(now - last_used) / 3600:.1f} hours ago)")
+
+run_store = RunStore(RUNS_FOLDER, RUN_STORE_MAX_BYTES, RUN_STORE_MAX_AGE)
+
+def analyze_run(saved_files, progress=None, timer=None, digests=None, base_run=None):
+    """
+    Analyse saved uploads, or reuse the stored run of identical uploads.
+    
+    With `base_run`, the uploads are added to that earlier run: its saved
+    AnalysisState is loaded and only the new files are read, and the
+    reports cover the files of both.
+    
+    Parameters:
+    saved_files (list): (index, filename, file_path) tuples from save_uploads
+    progress (callable): Optional progress(stage, done, total) callback
+    timer (StageTimer): Optional timer for the stages of a fresh run
+    digests (dict): Optional file_path -> SHA-256 digests from save_uploads
+    base_run (str): Optional id of the run to add the uploads to
+    
+    Returns:
+    tuple: (run id, preview_data), with preview_data None if the reports could not be generated
+    """
+    timer = timer or StageTimer()
+    rules = get_adobe_app_rules()
+    with timer.stage('hash uploads'):
+        run_id = run_store.run_id(saved_files, digests, base_run, rules.version)
+    
+    with run_store.lock(run_id):
+        # Check whether these uploads were analysed before
+        preview_data = run_store.load(run_id)
+        if preview_data is not None:
+            logger.info(f"Reusing the stored results of run {run_id}")
+            return run_id, preview_data
+        
+        state = AnalysisState(rules.version)
+        if base_run:
+            with timer.stage('load state'), run_store.lock(base_run):
+                state = run_store.load_state(base_run)
+            logger.info(f"Adding {len(saved_files)} files to run {base_run} ({state.file_count} files)")
+        
+        run_folder = run_store.create(run_id)
+        try:
+            first_usage = process_saved_files(saved_files, progress=progress, timer=timer, log_folder=run_folder,
+                                              state=state, rules=rules)
+            with timer.stage('save state'):
+                state.save(os.path.join(run_folder, AnalysisState.STATE_NAME))
+            if progress is not None:
+                progress('write reports', 0, 1)
+            success, preview_data = generate_college_usage_stats(first_usage, run_folder, timer)
+            if not success:
+                shutil.rmtree(run_folder, ignore_errors=True)
+                return run_id, None
+            preview_data['run_id'] = run_id
+            preview_data['base_run'] = base_run
+            run_store.save(run_id, preview_data)
+        except Exception:
+            shutil.rmtree(run_folder, ignore_errors=True)
+            raise
+    
+    stage_metrics.observe(timer)
+    run_store.evict(keep=run_id)
+    return run_id, preview_data
+
+class RunResults:
+    """
+    Queryable results of a stored run, for the JSON API.
+    
+    The per-user first usage and the UsageRollup come from the run's
+    AnalysisState, with the email classification applied once. Sorted
+    views and the college x app counts are built on first use and kept
+    with the object.
+    
+    Parameters:
+    run_id (str): Run id
+    preview_data (dict): The run's stored preview_data
+    users (pd.DataFrame): One row per user from FirstUsageAggregator.result()
+    rollup (UsageRollup): The run's usage rollup
+    """
+    
+    def __init__(self, run_id, preview_data, users, rollup=None):
+        self.run_id = run_id
+        self.preview_data = preview_data
+        email_classes = classify_emails(users['User Email'])
+        self.users = users
+        self.users['College'] = email_classes['College']
+        self.users['is_ust_student'] = email_classes['is_ust_student']
+        self.rollup = rollup if rollup is not None else UsageRollup()
+        self.rollup.finalize()
+        self._sorted = {}
+        self._app_counts = None
+        self._lock = threading.Lock()
+    
+    def app_counts(self):
+        """Return the count_college_apps table of the run's UST students."""
+        with self._lock:
+            if self._app_counts is None:
+                students = self.users[self.users['is_ust_student']]
+                colleges = [college.upper() for college in get_valid_colleges()]
+                self._app_counts = count_college_apps(students, colleges, get_all_adobe_apps())
+            return self._app_counts
+    
+    def trends(self, **query):
+        """Return usage_trends(**query) of the run's rollup."""
+        with self._lock:
+            return usage_trends(self.rollup, **query)
+    
+    def sorted_users(self, sort):
+        """
+        Return (users, keys) ordered by `sort` (one of API_USER_SORTS).
+        
+        keys is a sorted array of unique strings used by the page cursors:
+        the email, or the college and email joined by a NUL (which sorts
+        below any character, so the join orders like the pair).
+        """
+        with self._lock:
+            if sort not in self._sorted:
+                if sort == 'college':
+                    keys = (self.users['College'].astype(str) + '\0' + self.users['User Email']).to_numpy(dtype=object)
+                else:
+                    keys = self.users['User Email'].to_numpy(dtype=object)
+                order = np.argsort(keys, kind='mergesort')
+                self._sorted[sort] = (self.users.iloc[order].reset_index(drop=True), keys[order])
+            return self._sorted[sort]
+    
+    @classmethod
+    def load(cls, run_id):
+        """Return the RunResults of a stored run, or None if it is not available."""
+        preview_data = run_store.load(run_id)
+        if preview_data is None:
+            return None
+        state_path = os.path.join(run_store.path(run_id), AnalysisState.STATE_NAME)
+        with run_store.lock(run_id):
+            if not os.path.exists(state_path):
+                return None
+            with np.load(state_path, allow_pickle=False) as stored:
+                def section(prefix):
+                    return {name[len(prefix):]: stored[name] for name in stored.files if name.startswith(prefix)}
+                users = FirstUsageAggregator.from_arrays(section('first_usage.')).result()
+                rollup = section('rollup.')
+                rollup = UsageRollup.from_arrays(rollup) if rollup else None
+        return cls(run_id, preview_data, users, rollup)
+
+run_results_cache = OrderedDict()
+run_results_lock = threading.Lock()
+
+def get_run_results(run_id):
+    """Return the RunResults of a run, keeping the last API_CACHED_RUNS in memory."""
+    with run_results_lock:
+        results = run_results_cache.get(run_id)
+        if results is not None:
+            run_results_cache.move_to_end(run_id)
+            return results
+    
+    results = RunResults.load(run_id)
+    if results is not None:
+        with run_results_lock:
+            run_results_cache[run_id] = results
+            while len(run_results_cache) > API_CACHED_RUNS:
+                run_results_cache.popitem(last=False)
+    return results
+
+def encode_cursor(key):
+    """Opaque page cursor for the last sort key of a page."""
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Sort key of a cursor from encode_cursor; ValueError if it is malformed."""
+    try:
+        return base64.b64decode(cursor.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def report_files_signature(paths):
+    """Return a hex digest of the names, sizes and modification times of `paths`."""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+def build_reports_archive(folder):
+    """
+    Zip the reports in a run folder, reusing the previous archive while the
+    reports are unchanged.
+    
+    The signature of the reports is stored as the zip comment. Call it with
+    the run locked.
+    
+    Returns:
+    tuple: (archive path, signature), or (None, None) if there are no reports
+    """
+    archive_path = os.path.join(folder, REPORTS_ARCHIVE_NAME)
+    report_paths = [os.path.join(folder, file) for file in sorted(os.listdir(folder)) if file.endswith('.xlsx')]
+    if not report_paths:
+        return None, None
+    signature = report_files_signature(report_paths)
+    
+    # Check whether the archive of these reports already exists
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            if archive.comment == signature.encode():
+                return archive_path, signature
+    except (OSError, zipfile.BadZipFile):
+        pass
+    
+    logger.info(f"Building {archive_path} from {len(report_paths)} reports")
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.zip.tmp')
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(temp_path, 'w') as archive:
+            for path in report_paths:
+                archive.write(path, arcname=os.path.basename(path))
+            archive.comment = signature.encode()
+        os.replace(temp_path, archive_path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return archive_path, signature
+
+def run_analysis_job(job, upload_folder, saved_files, timer, digests=None, base_run=None):
+    """Run the full analysis for a job on a background thread."""
+    try:
+        run_id, preview_data = analyze_run(saved_files, progress=job.update_stage, timer=timer, digests=digests,
+                                           base_run=base_run)
+        if preview_data is not None:
+            job.finish(preview_data)
+        else:
+            job.fail("Failed to generate college statistics.")
+    except Exception as e:
+        job.fail(describe_error(e))
+    finally:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+
+def add_job(job):
+    """Register a job, forgetting the oldest finished ones beyond JOB_HISTORY."""
+    job.save()
+    with jobs_lock:
+        jobs[job.id] = job
+        finished = [job_id for job_id, old in jobs.items() if old.finished_at is not None]
+        for job_id in finished[:max(0, len(jobs) - JOB_HISTORY)]:
+            jobs.pop(job_id).discard()
+    expire_job_files()
+
+def expire_job_files(max_age=JOB_FILE_MAX_AGE):
+    """
+    Remove job status files, and temp files of interrupted saves, that have
+    not changed for max_age seconds. This covers jobs of any server
+    process, including ones that crashed or exited before their job
+    finished. A running job rewrites its file on every progress update;
+    jobs still running in this process are kept whatever its age.
+    """
+    with jobs_lock:
+        running = {job_id for job_id, job in jobs.items() if job.finished_at is None}
+    now = time.time()
+    for name in os.listdir(JOBS_FOLDER):
+        job_id = name.split('.', 1)[0]
+        if not AnalysisJob.JOB_ID_PATTERN.match(job_id) or job_id in running:
+            continue
+        path = os.path.join(JOBS_FOLDER, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            continue  # already removed by another process
+
+def get_job(job_id):
+    """Return a job started by this or another server process, or None."""
+    with jobs_lock:
+        job = jobs.get(job_id)
+    return job if job is not None else AnalysisJob.load(job_id)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    valid_files, error = get_uploaded_files()
+    if error:
+        return jsonify({'error': error}), 400
+    
+    # The request's file streams close when it ends, so save them now
+    upload_folder = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
+    timer = StageTimer()
+    digests = {}
+    try:
+        with timer.stage('save'):
+            saved_files = save_uploads(valid_files, upload_folder, digests)
+    except Exception as e:
+        shutil.rmtree(upload_folder, ignore_errors=True)
+        return jsonify({'error': describe_error(e)}), 400
+    
+    job = AnalysisJob(len(saved_files))
+    add_job(job)
+    job_executor.submit(run_analysis_job, job, upload_folder, saved_files, timer, digests,
+                        request.form.get('base_run') or None)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return render_template('index.html', error=f"Unknown analysis job: {job_id}")
+    if job.status == 'failed':
+        return render_template('index.html', error=job.error)
+    if job.status != 'done':
+        return render_template('index.html', error="The analysis is still running. Please wait and try again.")
+    
+    # A job run by another server process has its results in the run store
+    preview_data = job.preview_data if job.preview_data is not None else run_store.load(job.run_id or '')
+    if preview_data is None:
+        return render_template('index.html', error="The results of this analysis are no longer available. Please process files again.")
+    return render_template('index.html', success=True, file_count=job.file_count,
+                           preview_data=preview_data)
+
+def api_run_or_404(run_id):
+    """Return (RunResults, None), or (None, error response) for an unknown run."""
+    results = get_run_results(run_id)
+    if results is None:
+        return None, (jsonify({'error': f"Unknown or expired run: {run_id}"}), 404)
+    return results, None
+
+@app.route('/api/runs/<run_id>')
+def api_run_summary(run_id):
+    """Row and user totals and the uploaded files of a run."""
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    preview_data = results.preview_data
+    summary = {key: preview_data.get(key) for key in [
+        'run_id', 'base_run', 'total_users', 'ust_student_users', 'other_users',
+        'total_rows', 'duplicate_rows', 'duplicate_rows_approximate', 'files']}
+    summary['unique_rows'] = summary['total_rows'] - summary['duplicate_rows']
+    return jsonify(summary)
+
+@app.route('/api/runs/<run_id>/colleges')
+def api_run_colleges(run_id):
+    """UST student users per college, most users first."""
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    return jsonify({'colleges': [{'college': row['College'], 'users': row['Total Unique Users']}
+                                 for row in results.preview_data['all_colleges']]})
+
+@app.route('/api/runs/<run_id>/matrix')
+def api_run_matrix(run_id):
+    """First-usage counts of UST students, per college and app."""
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    app_counts = results.app_counts()
+    return jsonify({
+        'colleges': app_counts.columns.tolist(),
+        'apps': app_counts.index.tolist(),
+        'counts': app_counts.to_numpy().tolist(),  # one row per app, one column per college
+    })
+
+@app.route('/api/runs/<run_id>/leaders')
+def api_run_leaders(run_id):
+    """The college with the most first users of each app."""
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    return jsonify({'leaders': [{'app': app_name, 'college': college, 'users': count}
+                                for app_name, college, count in results.preview_data['highest_users_per_app']]})
+
+@app.route('/api/runs/<run_id>/users')
+def api_run_users(run_id):
+    """
+    Per-user first usage, one page at a time.
+    
+    Query parameters: sort ('email' or 'college'), limit, cursor (the
+    next_cursor of the previous page), and the filters college, app,
+    student ('true'/'false') and q (part of the email, case-insensitive).
+    """
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    
+    # Check the paging parameters
+    sort = request.args.get('sort', 'email')
+    if sort not in API_USER_SORTS:
+        return jsonify({'error': f"sort must be one of: {', '.join(API_USER_SORTS)}"}), 400
+    # A limit that is not a positive integer is an error; a larger one than
+    # API_MAX_PAGE_SIZE is capped
+    limit = request.args.get('limit', str(API_PAGE_SIZE)).strip()
+    if not limit.isascii() or not limit.isdigit() or int(limit) < 1:
+        return jsonify({'error': "limit must be a positive whole number"}), 400
+    limit = min(int(limit), API_MAX_PAGE_SIZE)
+    try:
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    users, keys = results.sorted_users(sort)
+    mask = np.ones(len(users), dtype=bool)
+    if request.args.get('college'):
+        mask &= (users['College'] == request.args['college'].upper()).to_numpy()
+    if request.args.get('app'):
+        mask &= (users['Adobe App'] == request.args['app']).to_numpy()
+    if request.args.get('student') in ('true', 'false'):
+        mask &= users['is_ust_student'].to_numpy() == (request.args['student'] == 'true')
+    if request.args.get('q'):
+        mask &= users['User Email'].str.contains(request.args['q'], case=False, regex=False).to_numpy()
+    
+    # Rows after the cursor key, in sort order
+    start = 0 if after is None else int(np.searchsorted(keys, after, side='right'))
+    positions = np.flatnonzero(mask[start:])[:limit + 1] + start
+    page = users.iloc[positions[:limit]]
+    timestamps = page['Timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    return jsonify({
+        'users': [
+            {'email': email, 'college': college, 'is_ust_student': bool(student),
+             'first_app': app_name, 'first_used_at': None if pd.isna(timestamp) else timestamp}
+            for email, college, student, app_name, timestamp in zip(
+                page['User Email'], page['College'], page['is_ust_student'], page['Adobe App'], timestamps)
+        ],
+        'next_cursor': encode_cursor(keys[positions[limit - 1]]) if len(positions) > limit else None,
+    })
+
+@app.route('/api/runs/<run_id>/trends')
+def api_run_trends(run_id):
+    """
+    Distinct active users per day, week or month.
+    
+    Query parameters: period ('day', 'week' or 'month'), by ('app',
+    'college' or 'college_app'), start and end (inclusive dates,
+    YYYY-MM-DD), and the filters college and app.
+    """
+    results, error = api_run_or_404(run_id)
+    if error:
+        return error
+    
+    query = {
+        'start': request.args.get('start'),
+        'end': request.args.get('end'),
+        'period': request.args.get('period', 'month'),
+        'by': request.args.get('by', 'app'),
+    }
+    try:
+        trends = results.trends(**query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('college') and 'College' in trends.columns:
+        trends = trends[trends['College'] == request.args['college'].upper()]
+    if request.args.get('app') and 'Adobe App' in trends.columns:
+        trends = trends[trends['Adobe App'] == request.args['app']]
+    
+    labels = {'Period': 'period', 'College': 'college', 'Adobe App': 'app', 'Users': 'users'}
+    trends = trends.assign(Period=trends['Period'].dt.strftime('%Y-%m-%d')).rename(columns=labels)
+    return jsonify(dict(query, series=[
+        {key: (int(value) if key == 'users' else value) for key, value in row.items()}
+        for row in trends.to_dict('records')
+    ]))
+
+@app.route('/api/rules')
+def api_rules():
+    """
+    The current app detection rules with the rows each has labelled, and
+    the latest paths no rule matched.
+    """
+    return jsonify(rule_hits.report(get_adobe_app_rules()))
+
+@app.route('/metrics')
+def metrics():
+    """Stage timings of completed runs and rule hit counts in Prometheus text format."""
+    return stage_metrics.render() + rule_hits.render(get_adobe_app_rules()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/download/<run_id>/<filename>')
+def download_file(run_id, filename):
     # Map simple filename to actual filepath
     file_mapping = {
         'overall_statistics.xlsx': 'overall_statistics.xlsx',
         'college_distribution.xlsx': 'college_distribution.xlsx', 
         'highest_college_users_per_app.xlsx': 'highest_college_users_per_app.xlsx',
-        'other_users.xlsx': 'other_users.xlsx'
+        'other_users.xlsx': 'other_users.xlsx',
+        'usage_trends.xlsx': 'usage_trends.xlsx'
     }
     
     # Check if the requested file exists in our mapping
     if filename not in file_mapping:
         return render_template('index.html', error=f"Invalid file requested: {filename}")
     
-    # Build the full file path
-    file_path = os.path.join(COLLEGE_STATS_FOLDER, file_mapping[filename])
-    
-    # Check if file exists
-    if not os.path.exists(file_path):
-        return render_template('index.html', error=f"The requested file {filename} is not available for download. Please process files first.")
+    # Check if the run is still stored
+    if run_store.load(run_id) is None:
+        return render_template('index.html', error="The results of this analysis are no longer available. Please process files again.")
     
-    # Set appropriate download filename
-    download_name = filename
-    
-    # Send the file
-    return send_file(file_path, as_attachment=True, download_name=download_name)
+    with run_store.lock(run_id):
+        # Build the full file path
+        file_path = os.path.join(run_store.path(run_id), file_mapping[filename])
+        
+        # Check if file exists
+        if not os.path.exists(file_path):
+            return render_template('index.html', error=f"The requested file {filename} is not available for download. Please process files first.")
+        
+        # Set appropriate download filename
+        download_name = filename
+        
+        # Send the file; clients revalidate (ETag → 304) in case the run was evicted and recomputed
+        return send_file(os.path.abspath(file_path), as_attachment=True, download_name=download_name,
+                         conditional=True, etag=report_files_signature([file_path]), max_age=0)
 
-@app.route('/download_all')
-def download_all():
-    # Check if the directory exists
-    if not os.path.exists(COLLEGE_STATS_FOLDER):
+@app.route('/download_all/<run_id>')
+def download_all(run_id):
+    # Check if the run is still stored
+    if run_store.load(run_id) is None:
         return render_template('index.html', error="No statistics files available for download. Please process files first.")
     
-    # Create a zip file of all Excel files
-    import zipfile
-    import tempfile
-    
-    # Create temp file for the zip
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    temp_file.close()
-    
-    # Create zip file
-    with zipfile.ZipFile(temp_file.name, 'w') as zipf:
-        for root, dirs, files in os.walk(COLLEGE_STATS_FOLDER):
-            for file in files:
-                if file.endswith('.xlsx'):
-                    file_path = os.path.join(root, file)
-                    zipf.write(file_path, arcname=file)
-    
-    # Return the zip file
-    return send_file(temp_file.name, as_attachment=True, download_name='adobe_college_stats.zip')
+    # Zip the reports, or reuse the zip of the same reports
+    with run_store.lock(run_id):
+        archive_path, signature = build_reports_archive(run_store.path(run_id))
+        if archive_path is None:
+            return render_template('index.html', error="No statistics files available for download. Please process files first.")
+        
+        # Return the zip file
+        return send_file(os.path.abspath(archive_path), as_attachment=True, download_name='adobe_college_stats.zip',
+                         conditional=True, etag=signature, max_age=0)
 
 @app.route("/")
 def home():
     return render_template("index.html")
 
+def create_app(preload=True):
+    """
+    Return the WSGI application for a production server (see wsgi.py).
+    
+    Settings come from the ADOBE_* environment variables read when this
+    module is imported (see env_setting). With `preload`, the detection
+    rules, the app detection cache, openpyxl and pyarrow are loaded
+    now. A server that imports the app once and then forks its workers
+    (gunicorn --preload) shares them copy-on-write instead of loading them
+    in every worker.
+    
+    Parameters:
+      preload (bool): Load the rules, cache, openpyxl and pyarrow up front
+    """
+    if preload:
+        rules = get_adobe_app_rules()
+        app_detection_cache.preload(rules.version)
+        import openpyxl  # the Excel reader and report writers import it on first use
+        import_pyarrow()
+        logger.info(f"Preloaded Adobe app rules {rules.version} and the app detection cache")
+        
+        # Keep the garbage collector off the preloaded objects, so collections
+        # in the workers do not write to (and copy) the shared pages
+        gc.freeze()
+    return app
+
 if __name__ == '__main__':
     # Disable the reloader to avoid compatibility issues
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,409 @@
+"""
+Benchmark harness for the Adobe log analysis pipeline.
+
+Generates synthetic Adobe Admin Console style logs, runs them through the
+same functions the web app uses, and records per-stage wall time, peak
+RSS and the in-memory bytes per row of the pipeline's tables as JSON so
+runs can be compared.
+
+Usage:
+  python benchmark.py                                   # 10K and 1M rows, CSV and XLSX
+  python benchmark.py --rows 10000 1000000 10000000 --formats csv
+  python benchmark.py --output after.json --compare before.json
+
+Generated logs are cached in the work folder (keyed by rows, format and
+seed), so repeated runs read identical inputs. Each scenario runs in a fresh
+Python process so that peak RSS belongs to that scenario alone.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is left out there
+    resource = None
+
+REPO_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ROWS = [10000, 1000000]
+DEFAULT_FORMATS = ['csv', 'xlsx']
+DEFAULT_WORK_FOLDER = os.path.join(tempfile.gettempdir(), 'adobe-analysis-bench')
+GENERATE_CHUNK_ROWS = 1000000  # rows generated at a time, and rows per generated workbook
+
+# Synthetic log shape
+LOG_COLUMNS = ['Timestamp', 'User Email', 'Event', 'Item Type', 'Item Path']
+ROWS_PER_USER = 25  # average log rows per distinct user
+ROWS_PER_PATH = 4  # average log rows per distinct item path
+LOG_START = np.datetime64('2024-01-01T00:00:00')
+LOG_SECONDS = 90 * 24 * 3600  # logs cover 90 days
+
+STUDENT_COLLEGES = [
+    'ab', 'acct', 'archi', 'cfad', 'cics', 'comm', 'crs', 'cthm',
+    'eccle', 'educ', 'ehs', 'eng', 'gs', 'gslaw', 'ipea', 'jhs',
+    'law', 'med', 'music', 'nur', 'pharma', 'sc', 'sci', 'shs', 'gensan'
+]
+OTHER_DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'adobe.com']
+EVENTS = ['File Opened', 'File Saved', 'File Created', 'File Synced']
+ITEM_TYPES = ['file', 'folder', 'asset']
+
+# (share of distinct paths, kind) - kinds map to the detection rules
+PATH_KINDS = [
+    (0.20, 'package'),
+    (0.30, 'extension'),
+    (0.08, 'scan'),
+    (0.07, 'cloud'),
+    (0.05, 'app name'),
+    (0.30, 'other'),
+]
+ADOBE_PACKAGES = ['acrobat', 'photoshop', 'illustrator', 'premiere', 'aftereffects',
+                  'lightroom', 'xd', 'indesign', 'animate', 'audition', 'express']
+ADOBE_EXTENSIONS = ['.psd', '.psb', '.ai', '.aic', '.prproj', '.aep', '.indd', '.idml',
+                    '.xd', '.lrcat', '.fla', '.sesx', '.dn', '.chproj', '.sbsar']
+APP_FOLDERS = ['Adobe Photoshop 2024', 'Adobe Illustrator 2024', 'Lightroom Classic',
+               'Adobe InDesign 2024', 'After Effects', 'Adobe Premiere Pro 2024']
+OTHER_EXTENSIONS = ['.pdf', '.docx', '.jpg', '.png', '.txt', '.mp4', '.zip']
+
+
+def make_users(count, rng):
+    """Return `count` distinct emails: students, other UST accounts and outside addresses."""
+    kinds = rng.choice(3, size=count, p=[0.6, 0.1, 0.3])
+    colleges = rng.choice(STUDENT_COLLEGES, size=count)
+    domains = rng.choice(OTHER_DOMAINS, size=count)
+    emails = []
+    for i, (kind, college, domain) in enumerate(zip(kinds, colleges, domains)):
+        if kind == 0:
+            emails.append(f"first{i}.last{i % 997}.{college}@ust.edu.ph")
+        elif kind == 1:
+            emails.append(f"staff{i}@ust.edu.ph" if i % 2 else f"first{i}.last.office@ust.edu.ph")
+        else:
+            emails.append(f"user{i}@{domain}")
+    return np.array(emails, dtype=object)
+
+
+def make_paths(count, rng):
+    """Return `count` distinct item paths covering every detection rule."""
+    shares = np.array([share for share, _ in PATH_KINDS])
+    kinds = rng.choice(len(PATH_KINDS), size=count, p=shares / shares.sum())
+    packages = rng.choice(ADOBE_PACKAGES, size=count)
+    extensions = rng.choice(ADOBE_EXTENSIONS, size=count)
+    folders = rng.choice(APP_FOLDERS, size=count)
+    other_extensions = rng.choice(OTHER_EXTENSIONS, size=count)
+    paths = []
+    for i, kind in enumerate(kinds):
+        kind = PATH_KINDS[kind][1]
+        if kind == 'package':
+            paths.append(f"/Users/u{i % 5000}/Library/Application Support/com.adobe.{packages[i]}/cache/{i}.dat")
+        elif kind == 'extension':
+            paths.append(f"/Users/u{i % 5000}/Documents/Project {i % 300}/Design {i}{extensions[i]}")
+        elif kind == 'scan':
+            paths.append(f"/cloud-content/Adobe Scan/Scan {i}.pdf")
+        elif kind == 'cloud':
+            paths.append(f"/assets/adobe-libraries/{i:08x}/elements/{i}.json")
+        elif kind == 'app name':
+            paths.append(f"/Applications/{folders[i]}/Presets/Preset {i}.xml")
+        else:
+            paths.append(f"/Users/u{i % 5000}/Downloads/file {i}{other_extensions[i]}")
+    return np.array(paths, dtype=object)
+
+
+def skewed_choice(count, size, rng):
+    """Draw `size` indexes below `count`, a few of them much more often than the rest."""
+    weights = 1.0 / np.arange(10, count + 10) ** 1.1
+    return rng.choice(count, size=size, p=weights / weights.sum())
+
+
+def generate_log(rows, seed=0, chunk_rows=GENERATE_CHUNK_ROWS):
+    """
+    Yield a synthetic log as DataFrames of at most `chunk_rows` rows.
+
+    Parameters:
+      rows (int): Total number of log rows
+      seed (int): Random seed; the same seed gives the same log
+      chunk_rows (int): Rows per yielded DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    users = make_users(max(rows // ROWS_PER_USER, 10), rng)
+    paths = make_paths(max(rows // ROWS_PER_PATH, 100), rng)
+
+    for start in range(0, rows, chunk_rows):
+        size = min(chunk_rows, rows - start)
+        seconds = np.sort(rng.integers(0, LOG_SECONDS, size=size))
+        timestamps = np.datetime_as_string(LOG_START + seconds.astype('timedelta64[s]'), unit='s')
+        yield pd.DataFrame({
+            'Timestamp': np.char.add(timestamps, 'Z'),
+            'User Email': users[skewed_choice(len(users), size, rng)],
+            'Event': rng.choice(EVENTS, size=size),
+            'Item Type': rng.choice(ITEM_TYPES, size=size),
+            'Item Path': paths[skewed_choice(len(paths), size, rng)],
+        }, columns=LOG_COLUMNS)
+
+
+def write_log(folder, rows, file_format, seed=0):
+    """
+    Write a synthetic log into `folder`, reusing files from an earlier run.
+
+    CSV logs are one file. XLSX logs are split into workbooks of at most
+    GENERATE_CHUNK_ROWS rows, as an Excel sheet cannot hold more than ~1M
+    rows. Both formats hold the same rows for the same seed.
+
+    Returns:
+      list: Paths of the written files
+    """
+    os.makedirs(folder, exist_ok=True)
+    stem = os.path.join(folder, f"adobe_logs_{rows}_{seed}")
+    done_marker = f"{stem}.{file_format}.done"
+    if os.path.exists(done_marker):
+        with open(done_marker) as f:
+            return json.load(f)
+
+    files = []
+    if file_format == 'csv':
+        path = f"{stem}.csv"
+        for i, chunk in enumerate(generate_log(rows, seed)):
+            chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        files.append(path)
+    else:
+        for chunk in generate_log(rows, seed):
+            path = f"{stem}_{len(files) + 1}.xlsx"
+            workbook = Workbook(write_only=True)
+            worksheet = workbook.create_sheet('Sheet1')
+            worksheet.append(LOG_COLUMNS)
+            for row in chunk.itertuples(index=False, name=None):
+                worksheet.append(row)
+            workbook.save(path)
+            files.append(path)
+
+    with open(done_marker, 'w') as f:
+        json.dump(files, f)
+    return files
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest finished child, in MB (None without `resource`)."""
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6
+    return round(own, 1), round(children, 1)
+
+
+class StageTimer:
+    """Collect wall time and peak RSS after each named stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        own, children = peak_rss_mb()
+        self.stages[stage] = {'seconds': round(seconds, 4)}
+        if own is None:
+            logging.getLogger('benchmark').info(f"{stage}: {seconds:.2f}s")
+        else:
+            self.stages[stage].update(peak_rss_mb=own, peak_rss_children_mb=children)
+            logging.getLogger('benchmark').info(f"{stage}: {seconds:.2f}s, peak RSS {own} MB")
+
+    def run(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.record(stage, time.perf_counter() - start)
+        return result
+
+
+def measure(files, workers, reference):
+    """
+    Run the pipeline stages over `files` in this process and return their timings.
+
+    Runs in a fresh work folder: the app creates its uploads folder and
+    detection cache relative to the current directory, so every scenario
+    starts with a cold cache.
+    """
+    sys.path.insert(0, REPO_FOLDER)
+    import app as analysis
+
+    timer = StageTimer()
+    saved_files = [(i, os.path.basename(path), path) for i, path in enumerate(files)]
+
+    # Parsing alone: read every chunk the way ingestion does, without labelling
+    def read_all():
+        rows = 0
+        item_paths = []
+        for _, _, path in saved_files:
+            if path.endswith('.csv'):
+                chunks = analysis.read_csv_chunks(path, analysis.detect_csv_encoding(path))
+            else:
+                chunks = analysis.read_excel_chunks(path)
+            for _, chunk in chunks:
+                rows += len(chunk)
+                item_paths.append(chunk['Item Path'].astype(str))
+        return rows, pd.concat(item_paths, ignore_index=True)
+    rows, item_paths = timer.run('read', read_all)
+
+    # In-memory size of one chunk as parsed and as the pipeline keeps it
+    first_path = saved_files[0][2]
+    if first_path.endswith('.csv'):
+        chunks = analysis.read_csv_chunks(first_path, analysis.detect_csv_encoding(first_path))
+    else:
+        chunks = analysis.read_excel_chunks(first_path)
+    _, chunk = next(iter(chunks))
+    memory = {
+        'chunk_rows': len(chunk),
+        'parsed_bytes_per_row': round(chunk.memory_usage(deep=True).sum() / len(chunk), 1),
+        'prepared_bytes_per_row': round(analysis.prepare_chunk(chunk).memory_usage(deep=True).sum() / len(chunk), 1),
+    }
+    del chunks, chunk
+
+    # Labelling alone, with an empty cache and again with a warm one
+    cache = analysis.AppDetectionCache(os.path.join('uploads', 'bench_cache.json'),
+                                      analysis.APP_CACHE_MAX_ENTRIES)
+    timer.run('classify', analysis.detect_adobe_apps, item_paths, cache=cache, persist=False)
+    timer.run('classify (cached)', analysis.detect_adobe_apps, item_paths, cache=cache, persist=False)
+    if reference:
+        timer.run('classify (extract_adobe_app)', item_paths.apply, analysis.extract_adobe_app)
+    del item_paths
+
+    # The full pipeline, as a job runs it; the app's own StageTimer breaks it down further
+    pipeline_timer = analysis.StageTimer()
+    marks = {}
+    def progress(stage, done, total):
+        marks.setdefault((stage, done >= total), time.perf_counter())
+    os.makedirs('reports', exist_ok=True)
+    first_usage = timer.run('ingest', analysis.process_saved_files, saved_files,
+                            workers=workers, progress=progress, timer=pipeline_timer, log_folder='reports')
+    timer.record('aggregate', marks[('aggregate', True)] - marks[('aggregate', False)])
+    ok, preview = timer.run('write reports', analysis.generate_college_usage_stats,
+                            first_usage, 'reports', pipeline_timer)
+    if not ok:
+        raise RuntimeError("generate_college_usage_stats failed")
+    memory['first_usage_bytes_per_user'] = round(first_usage.memory_usage(deep=True).sum() / max(len(first_usage), 1), 1)
+
+    pipeline = timer.stages['ingest']['seconds'] + timer.stages['write reports']['seconds']
+    return {
+        'rows': rows,
+        'users': preview['total_users'],
+        'stages': timer.stages,
+        'pipeline_stages': pipeline_timer.breakdown(),
+        'pipeline_seconds': round(pipeline, 4),
+        'rows_per_second': round(rows / pipeline) if pipeline else None,
+        'peak_rss_mb': peak_rss_mb()[0],
+        'peak_rss_children_mb': peak_rss_mb()[1],
+        'memory': memory,
+    }
+
+
+def run_scenario(rows, file_format, args):
+    """Generate (or reuse) the input for one scenario and measure it in a fresh process."""
+    log = logging.getLogger('benchmark')
+    data_folder = os.path.join(args.work_folder, 'data')
+
+    start = time.perf_counter()
+    files = write_log(data_folder, rows, file_format, args.seed)
+    log.info(f"{rows} rows as {file_format}: {len(files)} file(s) ready in {time.perf_counter() - start:.1f}s")
+
+    run_folder = tempfile.mkdtemp(prefix=f"run_{rows}_{file_format}_", dir=args.work_folder)
+    command = [sys.executable, os.path.abspath(__file__), '--measure', json.dumps({
+        'files': files, 'workers': args.workers, 'reference': args.reference,
+    })]
+    with open(os.path.join(run_folder, 'app.log'), 'w') as app_log:
+        finished = subprocess.run(command, cwd=run_folder, stdout=subprocess.PIPE,
+                                  stderr=app_log, universal_newlines=True)
+    if finished.returncode != 0:
+        raise RuntimeError(f"Scenario {rows}/{file_format} failed, see {run_folder}/app.log")
+
+    result = json.loads(finished.stdout.strip().splitlines()[-1])
+    result.update(format=file_format, files=len(files),
+                  input_bytes=sum(os.path.getsize(path) for path in files))
+    return result
+
+
+def environment():
+    """Describe the machine and code under test."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_FOLDER,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(previous, current):
+    """Print stage times of `current` against `previous`, scenario by scenario."""
+    old_results = {(r['rows'], r['format']): r for r in previous['results']}
+    for result in current['results']:
+        old = old_results.get((result['rows'], result['format']))
+        if old is None:
+            continue
+        print(f"\n{result['rows']} rows, {result['format']} "
+              f"({previous['environment'].get('commit')} -> {current['environment'].get('commit')})")
+        print(f"  {'stage':<30} {'before':>10} {'after':>10}  speedup")
+        for stage, timing in result['stages'].items():
+            if stage in old['stages']:
+                before, after = old['stages'][stage]['seconds'], timing['seconds']
+                ratio = f"{before / after:.2f}x" if after else '-'
+                print(f"  {stage:<30} {before:>9.2f}s {after:>9.2f}s  {ratio}")
+        if old.get('peak_rss_mb') is not None and result.get('peak_rss_mb') is not None:
+            print(f"  {'peak RSS (MB)':<30} {old['peak_rss_mb']:>9.0f}  {result['peak_rss_mb']:>9.0f}")
+        for name, after in result.get('memory', {}).items():
+            before = old.get('memory', {}).get(name)
+            if before is not None:
+                print(f"  {name:<30} {before:>10} {after:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='log sizes to run')
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'xlsx'], default=DEFAULT_FORMATS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes for ingestion')
+    parser.add_argument('--reference', action='store_true',
+                        help='also time extract_adobe_app row by row')
+    parser.add_argument('--work-folder', default=DEFAULT_WORK_FOLDER,
+                        help='where generated logs and run folders are kept')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        options = json.loads(args.measure)
+        print(json.dumps(measure(options['files'], options['workers'], options['reference'])))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    os.makedirs(args.work_folder, exist_ok=True)
+    results = {'environment': environment(), 'seed': args.seed, 'workers': args.workers, 'results': []}
+    for rows in args.rows:
+        for file_format in args.formats:
+            results['results'].append(run_scenario(rows, file_format, args))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logging.getLogger('benchmark').info(f"Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
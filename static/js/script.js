@@ -2,7 +2,14 @@ document.addEventListener('DOMContentLoaded', function() {
     const fileInput = document.getElementById('file-input');
     const fileList = document.getElementById('file-list');
     const form = document.getElementById('upload-form');
-    if (form) form.reset();  // Reset the form to clear inputs
+    const appendForm = document.getElementById('append-form');
+    
+    // The upload form and the results page's "Add New Logs" form both run as background jobs
+    [form, appendForm].forEach(jobForm => {
+        if (jobForm) jobForm.addEventListener('submit', submitAsJob);
+    });
+    if (!form) return;  // The rest sets up the upload page's file picker
+    form.reset();  // Reset the form to clear inputs
     
     // Display selected files
     fileInput.addEventListener('change', function() {
@@ -114,9 +121,9 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     // Show loading indicator on form submit
-    form.addEventListener('submit', function(e) {
+    function submitAsJob(e) {
         // Check if files are selected
-        const files = fileInput.files;
+        const files = this.querySelector('input[type="file"]').files;
         if (files.length === 0) {
             e.preventDefault();
             alert('Please select at least one file.');
@@ -147,14 +154,19 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Note: Removed success alert - let the backend handle validation and confirmation
         
+        // Submit as a background job and poll for progress instead of
+        // holding the request open until the analysis finishes
+        e.preventDefault();
+        
         // Create and show a loading indicator
         const loadingIndicator = document.createElement('div');
         loadingIndicator.className = 'loading-indicator';
         loadingIndicator.innerHTML = `
             <div class="spinner"></div>
-            <di class = "loading-text">
+            <div class = "loading-text">
                 <p>Generating college statistics...</p>
                 <p class = "sub">Please wait while your files are being processed. This may take a few minutes depending on file size.</p>
+                <p class = "sub job-progress"></p>
             </div>
         `;
         
@@ -163,7 +175,52 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Disable the submit button to prevent multiple submissions
         const submitBtn = this.querySelector('.submit-btn');
+        const submitLabel = submitBtn.textContent;
         submitBtn.disabled = true;
         submitBtn.textContent = 'Processing...';
-    });
+        
+        const progressText = loadingIndicator.querySelector('.job-progress');
+        
+        function resetForm(message) {
+            loadingIndicator.remove();
+            submitBtn.disabled = false;
+            submitBtn.textContent = submitLabel;
+            alert(message);
+        }
+        
+        function describeProgress(job) {
+            const stage = job.stages.find(s => s.status === 'running') ||
+                job.stages.filter(s => s.status === 'done').pop();
+            if (!stage) {
+                return 'Waiting to start...';
+            }
+            const count = stage.total ? ` (${stage.done} of ${stage.total})` : '';
+            return `Stage: ${stage.name}${count}`;
+        }
+        
+        function poll(job) {
+            fetch(job.status_url)
+                .then(response => response.json())
+                .then(status => {
+                    if (status.status === 'done' || status.status === 'failed') {
+                        window.location.href = status.result_url;
+                        return;
+                    }
+                    progressText.textContent = describeProgress(status);
+                    setTimeout(() => poll(status), 1000);
+                })
+                .catch(() => setTimeout(() => poll(job), 3000));
+        }
+        
+        fetch('/jobs', { method: 'POST', body: new FormData(this) })
+            .then(response => response.json().then(body => ({ ok: response.ok, body: body })))
+            .then(({ ok, body }) => {
+                if (!ok) {
+                    resetForm(body.error || 'Could not start processing.');
+                    return;
+                }
+                poll(body);
+            })
+            .catch(() => resetForm('Could not reach the server. Please try again.'));
+    }
 });
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Parity checks for the Adobe app detection.
+
+The batch matcher (AdobeAppRules.match, used by classify_adobe_apps and
+detect_adobe_apps) must label every path exactly as the per-path reference
+(AdobeAppRules.match_one, used by extract_adobe_app). The paths are fuzzed
+from the patterns the detection looks for and those of the rules file.
+
+Run with: python -m unittest discover tests
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+# Keep the app's uploads folder out of the working directory
+os.environ.setdefault('ADOBE_UPLOAD_FOLDER', tempfile.mkdtemp(prefix='adobe-analysis-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import app
+
+CORPUS_SIZE = 20000
+SEED = 0
+
+# Package ids, app names, folders and extensions the detection looks for
+PATTERNS = [
+    'com.adobe.acrobat', 'com.adobe.photoshop', 'com.adobe.xd', 'com.adobe.express',
+    'photoshop', 'illustrator', 'premiere', 'after effects', 'lightroom', 'acrobat',
+    'xd', 'indesign', 'animate', 'express',
+    '/lightroom/', 'lightroom classic', '/lrcat/',
+    '.psd', '.psb', '.ai', '.aic', '.prproj', '.aep', '.express', '.indd', '.idml',
+    '.lrcat', '.lrcat-wal', '.xd', '.xdc', '.fla', '.sesx', '.dw', '.pdf',
+    '/cloud-content/adobe scan/', '/adobe-libraries/', '/cloud-content',
+]
+
+# Paths where a folder name must not outrank the file's extension, and
+# where "xd" touches digits or underscores rather than standing alone
+KNOWN_LABELS = {
+    '/Users/me/Projects/XD/logo.psd': 'Adobe Photoshop',
+    '/Users/me/express/invoice.pdf': 'PDF Document',
+    '/data/0xd3f/report.ai': 'Adobe Illustrator',
+    '/x/file_xd_v2.indd': 'Adobe InDesign',
+    '/data/0xd3f/notes.txt': 'Other Adobe Files',
+    '/x/file_xd_v2/notes.txt': 'Other Adobe Files',
+    '/Users/me/Designs/XD/notes.txt': 'Adobe XD',
+    '/Users/me/Adobe Express/poster.png': 'Adobe Express',
+}
+
+
+def rule_patterns(rules_spec):
+    """Return the `contains` and `extension` texts of a rules file."""
+    return [text for rule in rules_spec['rules']
+            for text in (rule.get('contains'), rule.get('extension')) if text]
+
+
+def fuzzed_paths(patterns, size=CORPUS_SIZE, seed=SEED):
+    """
+    Return `size` paths glued together from pieces of `patterns`, in mixed
+    case and next to letters, digits and separators, plus a few odd values
+    (missing, non-string, empty).
+    """
+    rng = random.Random(seed)
+    fragments = ['/', '\\', '.', '..', ' ', '-', '_', 'a', 'x', 'd', '3', 'data', 'é', 'İ', 'ß', '\x00']
+    for text in patterns:
+        fragments += [text, text.upper(), text.title(), text[:-1], text[1:]]
+    paths = [''.join(rng.choice(fragments) for _ in range(rng.randint(0, 8))) for _ in range(size)]
+    return paths + [None, float('nan'), 123, '', '.psd', 'a.psd', '/x/.psd', 'xd', 'a/xd.psd', 'express.pdf']
+
+
+class AdobeAppParityTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(app.RULES_FILE, 'r', encoding='utf-8') as f:
+            cls.spec = json.load(f)
+        cls.paths = fuzzed_paths(PATTERNS + rule_patterns(cls.spec)) + list(KNOWN_LABELS)
+        cls.column = pd.Series(cls.paths, dtype=object)
+
+    def assert_match_parity(self, rules):
+        batch = rules.match(self.column)
+        reference = np.array([rules.match_one(path) for path in self.paths])
+        mismatches = np.flatnonzero(batch != reference)
+        self.assertEqual(len(mismatches), 0, [
+            (self.paths[i], rules.describe(batch[i]), rules.describe(reference[i])) for i in mismatches[:5]
+        ])
+
+    def test_match_equals_match_one(self):
+        self.assert_match_parity(app.get_adobe_app_rules())
+
+    def test_match_equals_match_one_without_word_rules(self):
+        spec = json.loads(json.dumps(self.spec))
+        for rule in spec['rules']:
+            rule.pop('word', None)
+        self.assert_match_parity(app.AdobeAppRules(spec))
+
+    def test_classify_adobe_apps_equals_extract_adobe_app(self):
+        labels = app.classify_adobe_apps(self.column)
+        expected = [app.extract_adobe_app(path) for path in self.paths]
+        mismatches = [(path, label, reference) for path, label, reference
+                      in zip(self.paths, labels.tolist(), expected) if label != reference]
+        self.assertEqual(mismatches[:5], [])
+
+    def test_known_labels(self):
+        paths = list(KNOWN_LABELS)
+        expected = list(KNOWN_LABELS.values())
+        self.assertEqual([app.extract_adobe_app(path) for path in paths], expected)
+        self.assertEqual(app.classify_adobe_apps(pd.Series(paths, dtype=object)).tolist(), expected)
+
+    def test_detect_adobe_apps_equals_extract_adobe_app(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = app.AppDetectionCache(os.path.join(folder, 'cache.json'), app.APP_CACHE_MAX_ENTRIES)
+            hits = app.RuleHitCounter()
+            expected = [app.extract_adobe_app(path) for path in self.paths]
+
+            # Once with an empty cache, then again from the cached rule ids
+            for _ in range(2):
+                labels = app.detect_adobe_apps(self.column, cache=cache, persist=False, hits=hits)
+                self.assertEqual(labels.astype(object).tolist(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Checks that uploads received into UPLOAD_FOLDER do not outlive their request.
+
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+# Keep the app's uploads folder out of the working directory
+os.environ.setdefault('ADOBE_UPLOAD_FOLDER', tempfile.mkdtemp(prefix='adobe-analysis-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+BOUNDARY = 'adobe-analysis-test'
+
+
+def multipart_body(rows):
+    """Return a multipart body with one CSV file part of `rows` rows and no closing boundary."""
+    header = (f'--{BOUNDARY}\r\n'
+              'Content-Disposition: form-data; name="files"; filename="logs.csv"\r\n'
+              'Content-Type: text/csv\r\n\r\n'
+              'User Email,Item Path,Timestamp\r\n')
+    return header.encode() + b'first.last.sci@ust.edu.ph,/Users/x/a.psd,2024-01-01 10:00:00\r\n' * rows
+
+
+class TruncatedUploadTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def spooled_files(self):
+        return [name for name in os.listdir(app.UPLOAD_FOLDER) if name.endswith('.upload')]
+
+    def assert_truncated_upload_removed(self, url):
+        response = self.client.post(url, data=multipart_body(5000),
+                                    content_type=f'multipart/form-data; boundary={BOUNDARY}')
+        self.assertIn(response.status_code, (200, 400))
+        self.assertEqual(self.spooled_files(), [])
+
+    def test_truncated_job_upload_is_removed(self):
+        self.assert_truncated_upload_removed('/jobs')
+
+    def test_truncated_page_upload_is_removed(self):
+        self.assert_truncated_upload_removed('/')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+Checks that usage_trends answers date ranges from the precomputed
+per-period counts exactly as counting the range's triples from scratch.
+
+Run with: python -m unittest discover tests
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+# Keep the app's uploads folder out of the working directory
+os.environ.setdefault('ADOBE_UPLOAD_FOLDER', tempfile.mkdtemp(prefix='adobe-analysis-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import app
+
+SEED = 0
+DATES = [None, '2023-11-01', '2023-11-20', '2023-11-27', '2023-12-01', '2023-12-03', '2023-12-31',
+         '2024-01-01', '2024-01-17', '2024-02-29', '2024-03-04', '2024-06-30', '2024-09-01']
+
+
+class UsageTrendsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(SEED)
+        rows = 20000
+        colleges = rng.choice(['sci', 'eng', 'cfad', 'ahs'], 500)
+        emails = [f'first{i}.last.{college}@ust.edu.ph' for i, college in enumerate(colleges)] + ['someone@gmail.com']
+        chunk = pd.DataFrame({
+            'User Email': rng.choice(emails, rows),
+            'Adobe App': pd.Categorical(rng.choice(['Adobe XD', 'Adobe Photoshop', 'PDF Document'], rows)),
+            'Timestamp': pd.Timestamp('2023-11-20') + pd.to_timedelta(rng.integers(0, 200 * 24, rows), unit='h'),
+        })
+        cls.rollup = app.UsageRollup()
+        cls.rollup.add(chunk)
+        cls.rollup.finalize()
+
+    def counted_from_scratch(self, start, end, period, by):
+        encoded = self.rollup.encoded()
+        days = encoded['days'].astype(np.int64)
+        keep = np.ones(len(days), dtype=bool)
+        if start:
+            keep &= days >= np.datetime64(start, 'D').astype(np.int64)
+        if end:
+            keep &= days <= np.datetime64(end, 'D').astype(np.int64)
+        return app.count_period_users(encoded, days[keep], encoded['user_codes'][keep],
+                                      encoded['app_codes'][keep], period, by)
+
+    def test_date_ranges_match_counting_from_scratch(self):
+        for start in DATES:
+            for end in DATES:
+                for period in app.TREND_PERIODS:
+                    for by in app.TREND_GROUPS:
+                        with self.subTest(start=start, end=end, period=period, by=by):
+                            trends = app.usage_trends(self.rollup, start, end, period, by)
+                            expected = self.counted_from_scratch(start, end, period, by)
+                            pd.testing.assert_frame_equal(trends.reset_index(drop=True).astype(object),
+                                                          expected.reset_index(drop=True).astype(object))
+
+    def test_invalid_date(self):
+        with self.assertRaises(ValueError):
+            app.usage_trends(self.rollup, start='2024-13-01')
+
+
+if __name__ == '__main__':
+    unittest.main()
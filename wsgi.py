@@ -0,0 +1,12 @@
+"""
+WSGI entry point for production servers.
+
+Start several worker processes that share the preloaded rules, e.g.:
+
+  gunicorn --preload --workers 4 --timeout 600 --bind 0.0.0.0:8000 wsgi:app
+
+Settings come from ADOBE_* environment variables; see readMe.md.
+"""
+from app import create_app
+
+app = create_app()